@@ -0,0 +1,241 @@
+import os
+import json
+import socket
+import traceback
+import pytz
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+import scripts.preprocess as preprocess
+import scripts.demand as demand
+import scripts.cop as cop
+import scripts.pipeline as pipeline
+import scripts.interim as interim
+import scripts.write as write
+from scripts.misc import divides_years, is_coarse, complete_steps
+
+
+# A build is split into tasks of one country and a range of years, which are written to a queue directory on a shared
+# file system. Workers on any number of nodes claim the tasks by creating claim files, which only one worker can
+# create, and write the national results of each task as shard. Finally, the shards are merged into the outputs.
+# Workers are started on each node with, e.g., python -c "import scripts.batch as batch; batch.work('/shared/queue')"
+
+
+def submit(queue_path, input_path, interim_path, countries, year_start, year_end, years_per_task=1,
+           resolution='60min'):
+
+    # The tasks are cut at the turn of the year (see pipeline.chunked)
+    if not divides_years(resolution):
+        raise ValueError('The time steps of resolution {} extend over the turn of the year.'.format(resolution))
+
+    for folder in ['tasks', 'claims', 'done', 'failed', 'shards']:
+        os.makedirs(os.path.join(queue_path, folder), exist_ok=True)
+
+    # Population and wind data are prepared once, so that the workers only read the shared interim files
+    mapped_population = preprocess.map_population(input_path, countries, interim_path, plot=False)
+    preprocess.wind(input_path, mapped_population, plot=False, interim_path=interim_path)
+
+    with open(os.path.join(queue_path, 'queue.json'), 'w') as f:
+        json.dump({'input_path': input_path, 'interim_path': interim_path, 'resolution': resolution}, f, indent=1)
+
+    # Each task reads the three days preceding its years in addition for the reference temperature (see pipeline.chunk)
+    for country in countries:
+        for start in range(year_start, year_end + 1, years_per_task):
+            task = {'country': country, 'year_start': start, 'year_end': min(start + years_per_task - 1, year_end)}
+            with open(os.path.join(queue_path, 'tasks', '{}.json'.format(name(task))), 'w') as f:
+                json.dump(task, f)
+
+    print('{} tasks submitted to {}.'.format(len(os.listdir(os.path.join(queue_path, 'tasks'))), queue_path))
+
+
+def name(task):
+
+    return '{}_{}_{}'.format(task['country'], task['year_start'], task['year_end'])
+
+
+def tasks(queue_path):
+
+    results = []
+    for file in sorted(os.listdir(os.path.join(queue_path, 'tasks'))):
+        with open(os.path.join(queue_path, 'tasks', file)) as f:
+            results.append(json.load(f))
+
+    return results
+
+
+def claim(queue_path, task):
+
+    # The claim file is created atomically, so that each task is claimed by exactly one worker
+    try:
+        fd = os.open(os.path.join(queue_path, 'claims', name(task)), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+
+    with os.fdopen(fd, 'w') as f:
+        f.write('{} {}'.format(socket.gethostname(), os.getpid()))
+
+    return True
+
+
+def work(queue_path):
+
+    with open(os.path.join(queue_path, 'queue.json')) as f:
+        config = json.load(f)
+    all_parameters = pipeline.parameters(config['input_path'])
+
+    for task in tasks(queue_path):
+
+        if not claim(queue_path, task):
+            continue
+
+        print('Task {} claimed.'.format(name(task)))
+        try:
+            mapped_population = preprocess.map_population(config['input_path'], [task['country']],
+                                                          config['interim_path'], plot=False)
+            wind = preprocess.wind(config['input_path'], mapped_population, plot=False,
+                                   interim_path=config['interim_path'])
+
+            final_heat, final_cop, energy = compute(config['input_path'], task['year_start'], task['year_end'],
+                                                    mapped_population, wind, all_parameters, config['resolution'])
+
+            interim.save(final_heat, os.path.join(queue_path, 'shards', '{}_heat'.format(name(task))))
+            interim.save(final_cop, os.path.join(queue_path, 'shards', '{}_cop'.format(name(task))))
+            interim.save(energy, os.path.join(queue_path, 'shards', '{}_energy'.format(name(task))))
+
+            open(os.path.join(queue_path, 'done', name(task)), 'w').close()
+
+        # Failed tasks remain claimed and are reported by status
+        except Exception:
+            with open(os.path.join(queue_path, 'failed', name(task)), 'w') as f:
+                f.write(traceback.format_exc())
+            print('Task {} failed.'.format(name(task)))
+
+
+def compute(input_path, year_start, year_end, mapped_population, wind, parameters, resolution):
+
+    # National results of a task as in pipeline.chunk, together with the energy per year of the heat demand, with
+    # which merge scales the heat profiles of all tasks of a country to 1 TWh/a on average over all years. The heat
+    # demand is rounded only after this scaling, and time steps above one hour, which are covered only partly by the
+    # years of the task, are kept to be joined in merge.
+    temperature = preprocess.temperature(input_path, year_start, year_end, mapped_population, lead_days=3,
+                                         processes=1)
+    reference_temperature = demand.reference_temperature(temperature['air']).loc[str(year_start):]
+    temperature = temperature.loc[str(year_start):]
+
+    hourly_space, hourly_water = pipeline.hourly(reference_temperature, wind, parameters, resolution)
+    energy = {'space': demand.yearly_energy(hourly_space, mapped_population),
+              'water': demand.yearly_energy(hourly_water, mapped_population)}
+
+    spatial_space = demand.finishing(hourly_space, mapped_population, parameters['building_database']['space'],
+                                     energy['space'])
+    spatial_water = demand.finishing(hourly_water, mapped_population, parameters['building_database']['water'],
+                                     energy['water'])
+    spatial_cop = cop.spatial_cop(cop.source_temperature(temperature), cop.sink_temperature(temperature),
+                                  parameters['cop_parameters'], resolution)
+
+    final_heat = demand.combine(spatial_space, spatial_water, resolution, rounded=False, partial_steps=True)
+    final_cop = cop.finishing(spatial_cop, spatial_space, spatial_water, resolution=resolution, partial_steps=True)
+
+    return final_heat, final_cop, pd.concat(energy, axis=1, names=['attribute', 'country', 'building_type'])
+
+
+def local(queue_path, workers=4):
+
+    # Several workers on the local machine, e.g., for testing
+    with ProcessPoolExecutor(workers) as executor:
+        list(executor.map(work, [queue_path] * workers))
+
+
+def status(queue_path):
+
+    # Tasks that are claimed, but neither done nor failed, are running or their worker has stopped
+    # Removing their claim file (and that of failed tasks) puts them back into the queue
+    states = {}
+    for task in tasks(queue_path):
+        if os.path.isfile(os.path.join(queue_path, 'done', name(task))):
+            states[name(task)] = 'done'
+        elif os.path.isfile(os.path.join(queue_path, 'failed', name(task))):
+            states[name(task)] = 'failed'
+        elif os.path.isfile(os.path.join(queue_path, 'claims', name(task))):
+            states[name(task)] = 'claimed'
+        else:
+            states[name(task)] = 'queued'
+
+    return pd.Series(states, name='state')
+
+
+def merge(queue_path, output_path=None, home_path=None):
+
+    states = status(queue_path)
+    if (states != 'done').any():
+        raise RuntimeError('{} of {} tasks are not done.'.format((states != 'done').sum(), len(states)))
+
+    with open(os.path.join(queue_path, 'queue.json')) as f:
+        resolution = json.load(f)['resolution']
+
+    # The shards are concatenated by years for each country, and then by countries
+    all_tasks = tasks(queue_path)
+    countries = sorted({task['country'] for task in all_tasks})
+
+    def load(task, variable):
+        return interim.load(os.path.join(queue_path, 'shards', '{}_{}'.format(name(task), variable)), mmap=False)
+
+    # The heat profiles of each shard are scaled to 1 TWh/a on average over the years of the shard. They are rescaled
+    # to the average over all years of the country with the energy of all shards as in a single run.
+    def rescale(df, energy, all_energy):
+        ratios = demand.normalization_factors(all_energy) / demand.normalization_factors(energy)
+        columns = [(country, 'heat_profile', '_'.join([attribute, building_type]), 'MW/TWh')
+                   for attribute, country, building_type in ratios.index]
+        df[columns] = (df[columns] * ratios.to_numpy()).astype(df[columns].dtypes)
+        return df
+
+    # For resolutions above one hour, the time step at the turn of the year in UTC is part of two shards (for
+    # countries east of UTC) and taken from the earlier one, which covers most of it
+    def deduplicate(df):
+        return df.loc[~df.index.duplicated()]
+
+    heat = []
+    cop = []
+    for country in countries:
+        country_tasks = sorted([task for task in all_tasks if task['country'] == country],
+                               key=lambda task: task['year_start'])
+        energy = [load(task, 'energy') for task in country_tasks]
+        all_energy = pd.concat(energy)
+
+        heat.append(deduplicate(pd.concat(
+            [rescale(load(task, 'heat'), task_energy, all_energy) for task, task_energy in zip(country_tasks, energy)]
+        )))
+        cop.append(deduplicate(pd.concat([load(task, 'cop') for task in country_tasks])))
+
+    final_heat = pd.concat(heat, axis=1)
+    final_cop = pd.concat(cop, axis=1)
+
+    # The first and last time step above one hour are dropped if the hours of all years in UTC cover them only partly
+    # as in demand.combine and cop.finishing
+    if is_coarse(resolution):
+        zones = [pytz.country_timezones[country][0] for country in countries]
+        starts = [pd.Timestamp(year=min(task['year_start'] for task in all_tasks), month=1, day=1, tz=zone)
+                  for zone in zones]
+        ends = [pd.Timestamp(year=max(task['year_end'] for task in all_tasks) + 1, month=1, day=1, tz=zone)
+                for zone in zones]
+        steps = complete_steps(pd.date_range(min(starts).tz_convert('utc'),
+                                             max(ends).tz_convert('utc') - pd.Timedelta('60min'), freq='60min'),
+                               resolution)
+        final_heat = final_heat.loc[final_heat.index.isin(steps)]
+        final_cop = final_cop.loc[final_cop.index.isin(steps)]
+
+    # Fill NA at the end and the beginning of the dataset arising from different local times as in demand.combine and
+    # cop.finishing, where absolute values remain missing in the years without building data
+    values = np.round(final_heat.to_numpy())
+    demand.fill_edges(values, final_heat.columns.get_level_values('unit') == 'MW')
+    final_heat = pd.DataFrame(values, index=final_heat.index, columns=final_heat.columns)
+    final_cop = final_cop.fillna(method='bfill').fillna(method='ffill')
+
+    shaped_dfs = write.shaping(final_heat, final_cop)
+
+    if output_path is not None:
+        write.to_sql(shaped_dfs, output_path, home_path)
+        write.to_csv(shaped_dfs, output_path)
+
+    return shaped_dfs
@@ -0,0 +1,202 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Two built outputs, i.e., multiindex CSV files (see write.to_csv) or SQLite files (see write.to_sql), are compared
+# block by block of rows, so that the memory use does not depend on the length of the time series. The columns are
+# split between processes, each of which streams both files for its columns only.
+
+# Differences up to the rounding precision in demand.combine and cop.finishing are tolerated by default
+tolerances = {'heat_demand': 1, 'heat_profile': 1, 'COP': .01}
+
+# The variables are part of the column keys, which are the column names of the singleindex shape
+variables = ['heat_demand', 'heat_profile', 'COP']
+
+
+def compare(file_a, file_b, tolerances=tolerances, block_size=8760, processes=4):
+
+    columns_a = columns(file_a)
+    columns_b = columns(file_b)
+    common = [key for key in columns_a if key in columns_b]
+
+    # Columns are assigned round robin, so that all processes get columns of each variable
+    groups = [common[i::processes] for i in range(processes) if common[i::processes]]
+    args = (repeat(file_a), repeat(file_b), groups, repeat(tolerances), repeat(block_size))
+    if processes > 1 and len(groups) > 1:
+        with ProcessPoolExecutor(processes) as executor:
+            results = list(executor.map(compare_columns, *args))
+    else:
+        results = list(map(compare_columns, *args))
+
+    report = pd.concat([result[0] for result in results]).reindex(common) if results else pd.DataFrame()
+
+    # Columns, which are only in one of the files, are reported without differences
+    only = pd.DataFrame(
+        {'only_in': ['a'] * len(set(columns_a) - set(common)) + ['b'] * len(set(columns_b) - set(common))},
+        index=[key for key in columns_a if key not in common] + [key for key in columns_b if key not in common]
+    )
+    report = pd.concat([report, only])
+    report.index.name = 'column'
+
+    rows = results[0][1] if results else {'common': 0, 'only_a': 0, 'only_b': 0}
+    summary(report, rows)
+
+    return report
+
+
+def columns(file):
+
+    if is_sqlite(file):
+        with sqlite3.connect(file) as con:
+            names = [row[1] for row in con.execute('PRAGMA table_info(when2heat)')]
+        return [name for name in names if name not in ['utc_timestamp', 'cet_cest_timestamp']]
+
+    header = pd.read_csv(file, header=[0, 1, 2, 3], index_col=[0, 1], nrows=0)
+
+    return ['_'.join(column[0:3]) for column in header.columns]
+
+
+def is_sqlite(file):
+
+    return os.path.splitext(file)[1] in ['.sqlite', '.db']
+
+
+def blocks(file, keys, block_size):
+
+    # Blocks of rows with the UTC timestamps as strings in the format of write.timestamps, which sort chronologically
+    if is_sqlite(file):
+        query = 'SELECT utc_timestamp, {} FROM when2heat ORDER BY utc_timestamp'.format(
+            ', '.join('"{}"'.format(key) for key in keys)
+        )
+        with sqlite3.connect(file) as con:
+            for block in pd.read_sql_query(query, con, index_col='utc_timestamp', chunksize=block_size):
+                yield block.astype('float64')
+
+    else:
+        # The multiindex header cannot be parsed together with selected columns, so that the rows after the four
+        # header rows and the row with the index names are read by position
+        positions = {key: i + 2 for i, key in enumerate(columns(file))}
+        usecols = [0] + [positions[key] for key in keys]
+        for block in pd.read_csv(file, header=None, skiprows=5, usecols=usecols, index_col=0,
+                                 chunksize=block_size):
+            block.index.name = 'utc_timestamp'
+            block.columns = [key for _, key in sorted(zip(usecols[1:], keys))]
+            yield block[keys].astype('float64')
+
+
+def tolerance(key, tolerances):
+
+    for variable in variables:
+        if '_{}_'.format(variable) in key:
+            return tolerances.get(variable, 0)
+
+    return 0
+
+
+def compare_columns(file_a, file_b, keys, tolerances, block_size):
+
+    n = len(keys)
+    limits = np.array([tolerance(key, tolerances) for key in keys], dtype='float64')
+    max_abs = np.zeros(n)
+    max_rel = np.zeros(n)
+    exceeding = np.zeros(n, dtype='int64')
+    nan_mismatches = np.zeros(n, dtype='int64')
+    first = np.full(n, None, dtype=object)
+    rows = {'common': 0, 'only_a': 0, 'only_b': 0}
+
+    def update(a, b):
+
+        # Small differences from the decimal representation are not counted as exceeding the tolerance
+        abs_diff = np.abs(a.to_numpy() - b.to_numpy())
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rel_diff = abs_diff / np.abs(b.to_numpy())
+        rel_diff[abs_diff == 0] = 0
+        nan_mismatch = np.isnan(a.to_numpy()) != np.isnan(b.to_numpy())
+        diverging = nan_mismatch | (abs_diff > limits + 1e-9)
+
+        np.fmax(max_abs, np.nan_to_num(abs_diff, nan=0).max(axis=0), out=max_abs)
+        np.fmax(max_rel, np.nan_to_num(rel_diff, nan=0, posinf=np.inf).max(axis=0), out=max_rel)
+        exceeding[:] += diverging.sum(axis=0)
+        nan_mismatches[:] += nan_mismatch.sum(axis=0)
+
+        for i in np.flatnonzero(diverging.any(axis=0) & pd.isna(first)):
+            first[i] = a.index[np.argmax(diverging[:, i])]
+
+        rows['common'] += len(a)
+
+    # The blocks of both files are aligned by a merge on the sorted timestamps. Rows, which are not yet matched, are
+    # carried over to the next block.
+    blocks_a = blocks(file_a, keys, block_size)
+    blocks_b = blocks(file_b, keys, block_size)
+    rest_a = rest_b = None
+    done_a = done_b = False
+
+    while True:
+        if not done_a and (rest_a is None or rest_a.empty):
+            rest_a, done_a = next_block(blocks_a, rest_a)
+        if not done_b and (rest_b is None or rest_b.empty):
+            rest_b, done_b = next_block(blocks_b, rest_b)
+        if (rest_a is None or rest_a.empty) and (rest_b is None or rest_b.empty):
+            break
+
+        # Rows are matched up to the last timestamp in both blocks, unless one of the files has ended
+        if done_a or rest_a.empty:
+            end = rest_b.index[-1]
+        elif done_b or rest_b.empty:
+            end = rest_a.index[-1]
+        else:
+            end = min(rest_a.index[-1], rest_b.index[-1])
+
+        part_a = rest_a.loc[rest_a.index <= end]
+        part_b = rest_b.loc[rest_b.index <= end]
+        rest_a = rest_a.loc[rest_a.index > end]
+        rest_b = rest_b.loc[rest_b.index > end]
+
+        matched = part_a.index.intersection(part_b.index, sort=False)
+        rows['only_a'] += len(part_a) - len(matched)
+        rows['only_b'] += len(part_b) - len(matched)
+        if len(matched):
+            update(part_a.loc[matched], part_b.loc[matched])
+
+    report = pd.DataFrame({
+        'tolerance': limits,
+        'max_abs_diff': max_abs,
+        'max_rel_diff': max_rel,
+        'exceeding': exceeding,
+        'nan_mismatches': nan_mismatches,
+        'first_divergence': first
+    }, index=pd.Index(keys, name='column'))
+
+    return report, rows
+
+
+def next_block(blocks, rest):
+
+    try:
+        block = next(blocks)
+    except StopIteration:
+        return rest, True
+
+    return (block if rest is None else pd.concat([rest, block])), False
+
+
+def summary(report, rows):
+
+    print('{} common rows, {} rows only in a, {} rows only in b.'.format(
+        rows['common'], rows['only_a'], rows['only_b']
+    ))
+    if 'only_in' in report.columns and report['only_in'].notna().any():
+        print('{} columns only in one of the files.'.format(report['only_in'].notna().sum()))
+    if 'exceeding' in report.columns:
+        diverging = report.loc[report['exceeding'] > 0]
+        print('{} of {} common columns differ beyond the tolerance.'.format(
+            len(diverging), report['exceeding'].notna().sum()
+        ))
+        for key, row in diverging.iterrows():
+            print('  {}: {} values, max. abs. difference {:g}, {} NaN mismatches, first at {}'.format(
+                key, row['exceeding'], row['max_abs_diff'], row['nan_mismatches'], row['first_divergence']
+            ))
@@ -1,8 +1,11 @@
 
 import os
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
-from scripts.misc import localize
+import scripts.kernels as kernels
+from scripts.misc import localize, upsample_df, model_resolution, is_coarse, complete_steps
 from scripts.misc import group_df_by_multiple_column_levels
 
 
@@ -30,18 +33,23 @@ def sink_temperature(temperature):
     )
 
 
-def spatial_cop(source, sink, cop_parameters):
+def spatial_cop(source, sink, cop_parameters, resolution='60min'):
 
-    def cop_curve(delta_t, source_type):
-        delta_t = delta_t.clip(lower=15)
+    def cop_curve(sink_df, source_df, source_type):
+        if kernels.backend != 'pandas':
+            return pd.DataFrame(
+                kernels.cop(sink_df.to_numpy(), source_df[sink_df.columns].to_numpy(), cop_parameters[source_type]),
+                index=sink_df.index, columns=sink_df.columns
+            )
+        delta_t = (sink_df - source_df).clip(lower=15)
         return sum(cop_parameters.loc[i, source_type] * delta_t ** i for i in range(3))
 
     source_types = source.columns.get_level_values('source').unique()
     sink_types = sink.columns.get_level_values('sink').unique()
 
-    return pd.concat(
+    df = pd.concat(
         [pd.concat(
-            [cop_curve(sink[sink_type] - source[source_type], source_type)
+            [cop_curve(sink[sink_type], source[source_type], source_type)
              for sink_type in sink_types],
             keys=sink_types,
             axis=1
@@ -49,10 +57,25 @@ def spatial_cop(source, sink, cop_parameters):
         keys=source_types,
         axis=1,
         names=['source', 'sink', 'country', 'latitude', 'longitude']
-    ).round(4).swaplevel(0, 2, axis=1)
+    )
+
+    return resample_cop(df, resolution).round(4).swaplevel(0, 2, axis=1)
+
+
+def resample_cop(df, resolution):
 
+    # Coarser resolutions are aggregated after the spatial aggregation (see finishing)
+    step = df.index[1] - df.index[0]
+    resolution = model_resolution(resolution)
 
-def finishing(cop, demand_space, demand_water, correction=.85):
+    # Finer resolutions are linearly interpolated, and the last hour is extended as for the heat demand
+    if pd.Timedelta(to_offset(resolution)) < step:
+        return df.reindex(upsample_df(df, resolution, step).index).interpolate()
+
+    return df
+
+
+def to_utc(cop):
 
     # Localize Timestamps (including daylight saving time correction) and convert to UTC
     countries = cop.columns.get_level_values('country').unique()
@@ -64,10 +87,16 @@ def finishing(cop, demand_space, demand_water, correction=.85):
                 keys=sinks, axis=1
             )], keys=[country], axis=1
         ).swaplevel(0, 2, axis=1) for country in countries],
-        axis=1, names=['source', 'sink', 'country', 'latitude', 'longitude']
+        axis=1
     ).sort_index(axis=1)
+    cop.columns.names = ['source', 'sink', 'country', 'latitude', 'longitude']
+
+    return cop
+
 
+def finishing(cop, demand_space, demand_water, correction=.85, resolution='60min', partial_steps=False):
 
+    cop = to_utc(cop)
 
     # Prepare demand values
     demand_space = demand_space.loc[:, demand_space.columns.get_level_values('unit') == 'MW/TWh']
@@ -99,6 +128,17 @@ def finishing(cop, demand_space, demand_water, correction=.85):
         ) for source in sources],
         keys=sources, axis=1, names=['source', 'sink', 'country']
     )
+
+    # Resolutions above one hour are aggregated in UTC as the ratio of the heat to the power over each time step, where
+    # partly covered time steps at the beginning and the end are dropped as in demand.combine
+    if is_coarse(resolution):
+        steps = None if partial_steps else complete_steps(heat.index, resolution)
+        heat = heat.resample(resolution).sum(min_count=1)
+        power = power.resample(resolution).sum(min_count=1)
+        if steps is not None:
+            heat = heat.loc[steps]
+            power = power.loc[steps]
+
     cop = heat / power
 
     # Correction and round
@@ -120,38 +160,66 @@ def finishing(cop, demand_space, demand_water, correction=.85):
     return cop
 
 
-def validation(cop, heat, output_path, corrected):
-
-    def averages(df):
-        return pd.concat(
-            [df.loc[(df.index >= pd.Timestamp(year=2011, month=7, day=1, tz='utc'))
-                    & (df.index < pd.Timestamp(year=2012, month=7, day=1, tz='utc')), ].sum(),
-             df.loc[(df.index >= pd.Timestamp(year=2012, month=7, day=1, tz='utc'))
-                    & (df.index < pd.Timestamp(year=2013, month=7, day=1, tz='utc')), ].sum()],
-            keys=['2011/2012', '2012/2013'], axis=1
-        )
-
-    # Data preparation
-    cop = cop['DE']['COP']
-    cop.columns = cop.columns.droplevel(1)
-
-    heat = heat['DE']['heat_profile']
-    heat.columns = heat.columns.droplevel(1)
-
-    # Power calculation
-    power = pd.DataFrame()
-    for heat_pump in ['ASHP', 'GSHP', 'WSHP']:
-        power[heat_pump] = (
-            .8 * .85 * heat['space_SFH'] / cop['{}_{}'.format(heat_pump, 'floor')] +
-            .8 * .15 * heat['space_SFH'] / cop['{}_{}'.format(heat_pump, 'radiator')] +
-            .2 * heat['water_SFH'] / cop['{}_water'.format(heat_pump)]
-        )
-    heat = pd.concat([.8 * heat['space_SFH'] + .2 * heat['water_SFH']]*3, axis=1, keys=power.columns)
-
-    # Monthly aggregation
-    heat = averages(heat)
-    power = averages(power)
+# Heating seasons and shares of the heat sinks (for space heating, 80 % of the heat is assumed to be supplied to
+# floor and 20 % to radiator heating, and the share of water heating in total heat supply is 20 %)
+validation_periods = [('2011/2012', '2011-07-01', '2012-07-01'), ('2012/2013', '2012-07-01', '2013-07-01')]
+validation_shares = {'default': {'floor': .8 * .85, 'radiator': .8 * .15, 'water': .2}}
+
+
+def validation(cop, heat, output_path, corrected, countries=None, periods=validation_periods,
+               shares=validation_shares, building_type='SFH'):
+
+    # Performance factors, i.e., the ratio of heat to power over a period, for all countries (if None), heat pumps,
+    # periods (label, start and end in UTC) and sets of sink shares. The results are written as a tidy table.
+    heat_pumps = ['ASHP', 'GSHP', 'WSHP']
+    sinks = ['floor', 'radiator', 'water']
+    if countries is None:
+        countries = sorted(set(cop.columns.get_level_values('country'))
+                           & set(heat.columns.get_level_values('country')))
+
+    # Period codes by binary search on the UTC index, -1 for timestamps outside all periods
+    edges = np.array([timestamp.value for _, start, end in periods
+                      for timestamp in [pd.Timestamp(start, tz='utc'), pd.Timestamp(end, tz='utc')]])
+    if (np.diff(edges) < 0).any():
+        raise ValueError('The periods must be in chronological order and must not overlap.')
+    position = np.searchsorted(edges, cop.index.tz_convert('utc').asi8, side='right')
+    codes = np.where(position % 2 == 1, position // 2, -1)
+    rows = codes >= 0
+
+    # Arrays of the heat profiles (rows, countries, sinks) and the COP (rows, countries, heat pumps, sinks)
+    profiles = heat.reindex(index=cop.index, columns=pd.MultiIndex.from_product(
+        [countries, ['heat_profile'], ['space_{}'.format(building_type), 'water_{}'.format(building_type)],
+         ['MW/TWh']]
+    )).to_numpy(dtype='float64')[rows].reshape(-1, len(countries), 2)
+    profiles = profiles[:, :, [0, 0, 1]]
+    coefficients = cop.reindex(columns=pd.MultiIndex.from_product(
+        [countries, ['COP'], ['{}_{}'.format(heat_pump, sink) for heat_pump in heat_pumps for sink in sinks],
+         ['coefficient']]
+    )).to_numpy(dtype='float64')[rows].reshape(-1, len(countries), len(heat_pumps), len(sinks))
+
+    # Heat and power for all share sets at once (rows, countries, share sets, heat pumps)
+    weights = np.array([[shares[name][sink] for sink in sinks] for name in shares])
+    heat_supply = np.einsum('tck,sk->tcs', profiles, weights)
+    power = np.einsum('tchk,sk->tcsh', profiles[:, :, None, :] / coefficients, weights)
+    heat_supply = np.broadcast_to(heat_supply[:, :, :, None], power.shape)
+
+    # One grouped reduction of heat and power over the periods
+    sums = pd.DataFrame(
+        np.concatenate([heat_supply.reshape(len(power), -1), power.reshape(len(power), -1)], axis=1)
+    ).groupby(codes[rows]).sum().reindex(range(len(periods)))
+    sums = sums.to_numpy().reshape(len(periods), 2, len(countries), len(shares), len(heat_pumps))
+
+    index = pd.MultiIndex.from_product(
+        [countries, list(shares), heat_pumps, [label for label, _, _ in periods]],
+        names=['country', 'shares', 'heat_pump', 'period']
+    )
+    results = pd.DataFrame({
+        'heat': sums[:, 0].transpose(1, 2, 3, 0).ravel(),
+        'power': sums[:, 1].transpose(1, 2, 3, 0).ravel()
+    }, index=index)
+    results['cop'] = results['heat'] / results['power']
+    results = results.round(2)
 
-    cop = heat/power
+    results.to_csv(os.path.join(output_path, 'cop_{}.csv'.format(corrected)), sep=';', decimal=',')
 
-    cop.round(2).to_csv(os.path.join(output_path, 'cop_{}.csv'.format(corrected)), sep=';', decimal=',')
+    return results
@@ -0,0 +1,259 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
+import scripts.interim as interim
+import scripts.preprocess as preprocess
+import scripts.pipeline as pipeline
+import scripts.demand as demand
+import scripts.write as write
+
+
+# Long-running local service for repeated small runs (e.g., one country, other years or heating thresholds). The
+# temperature of each country selection and year is read once and kept in memory-mapped files (by default in the
+# shared memory file system /dev/shm), from where the processes of a pool use it without copying. The processes keep
+# the parameter tables and the localized time indices (see misc.localize) between requests. Datasets, which are
+# not in use, are evicted when the memory budget is exceeded or after they have been idle for a while.
+#
+# Requests are sent by HTTP, e.g.,
+# curl -d '{"countries": ["DE"], "year_start": 2015, "year_end": 2015, "heating_thresholds": {"DE": 14}}' \
+#     http://127.0.0.1:8001/compute
+# and the results are streamed back as CSV with the column names of the singleindex shape. The datasets in memory
+# are listed at http://127.0.0.1:8001/status
+
+# State of the pool processes
+_parameters = {}
+_attached = {}
+
+
+def warm():
+
+    # The optional dependencies are imported once per process instead of once per request
+    for module in ['netCDF4', 'geopandas', 'shapely.geometry']:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+
+
+def prepare(input_path, interim_path, countries):
+
+    mapped_population = preprocess.map_population(input_path, list(countries), interim_path, plot=False)
+    wind = preprocess.wind(input_path, mapped_population, plot=False, interim_path=interim_path)
+
+    return mapped_population, wind
+
+
+def load(input_path, year, mapped_population, prefix):
+
+    # The temperature of a year including the three preceding days for the reference temperature (see pipeline.chunk)
+    df = preprocess.temperature(input_path, year, year, mapped_population, lead_days=3, processes=1)
+    values = df.to_numpy()
+
+    # The file is owned by the service, which removes it on eviction
+    file = '{}{}.npy'.format(prefix, uuid.uuid4().hex)
+    np.save(file, values)
+
+    return {
+        'name': file,
+        'nbytes': values.nbytes,
+        'index': interim.encode(df.index),
+        'columns': interim.encode(df.columns)
+    }
+
+
+def attach(descriptor):
+
+    name = descriptor['name']
+    if name not in _attached:
+        _attached[name] = pd.DataFrame(np.load(name, mmap_mode='r'), index=interim.decode(*descriptor['index']),
+                                       columns=interim.decode(*descriptor['columns']), copy=False)
+
+    return _attached[name]
+
+
+def release(live):
+
+    # Mappings of evicted datasets are dropped, so that their memory is freed
+    for name in set(_attached) - set(live):
+        del _attached[name]
+
+
+def compute(request, input_path, descriptors, mapped_population, wind, live):
+
+    release(live)
+
+    if input_path not in _parameters:
+        _parameters[input_path] = pipeline.parameters(input_path)
+    parameters = dict(_parameters[input_path])
+
+    # Heating thresholds can be changed per request
+    if 'heating_thresholds' in request:
+        parameters['heating_thresholds'] = parameters['heating_thresholds'].copy()
+        parameters['heating_thresholds'].update(pd.Series(request['heating_thresholds'], dtype='float64'))
+
+    year_start = request['year_start']
+    temperature = pd.concat([attach(descriptor) if i == 0 else attach(descriptor).loc[str(year):]
+                             for i, (year, descriptor) in enumerate(descriptors)])
+    reference_temperature = demand.reference_temperature(temperature['air']).loc[str(year_start):]
+    temperature = temperature.loc[str(year_start):]
+
+    resolution = request.get('resolution', '60min')
+    final_heat, final_cop = pipeline.national(*pipeline.spatial(
+        temperature, reference_temperature, wind, mapped_population, parameters,
+        resolution, request.get('country_mean', False)
+    ), resolution)
+
+    return pd.concat([final_heat, final_cop], axis=1)
+
+
+def serve(input_path, interim_path, host='127.0.0.1', port=8001, processes=4, memory=4e9, idle=3600,
+          block_size=744, shared_path='/dev/shm'):
+
+    # memory is the budget for the temperature datasets in bytes and idle the time in seconds, after which unused
+    # datasets are evicted. Results are streamed in blocks of rows. Without /dev/shm (e.g., on Windows or macOS), the
+    # datasets are stored in the interim directory instead.
+    if not os.path.isdir(shared_path):
+        shared_path = interim_path
+    prefix = os.path.join(shared_path, 'when2heat_{}_'.format(os.getpid()))
+    executor = ProcessPoolExecutor(processes, initializer=warm)
+
+    datasets = OrderedDict()
+    loading = {}
+    populations = {}
+
+    def evict(budget):
+        for key in [key for key, entry in datasets.items() if entry['users'] == 0]:
+            if sum(entry['nbytes'] for entry in datasets.values()) <= budget \
+                    and time.time() - datasets[key]['used'] < idle:
+                continue
+            os.remove(datasets.pop(key)['descriptor']['name'])
+            print('Temperature of {} in {} evicted.'.format(', '.join(key[0]), key[1]))
+
+    async def acquire(countries, year, mapped_population):
+        key = (countries, year)
+        while key not in datasets:
+            if key in loading:
+                await asyncio.shield(loading[key])
+                continue
+            loading[key] = asyncio.get_running_loop().create_future()
+            try:
+                descriptor = await asyncio.get_running_loop().run_in_executor(
+                    executor, load, input_path, year, mapped_population, prefix
+                )
+                datasets[key] = {'descriptor': descriptor, 'nbytes': descriptor['nbytes'], 'users': 0,
+                                 'used': time.time()}
+                print('Temperature of {} in {} loaded.'.format(', '.join(countries), year))
+            finally:
+                loading.pop(key).set_result(None)
+
+        datasets.move_to_end(key)
+        datasets[key]['users'] += 1
+
+        return datasets[key]['descriptor']
+
+    async def run(request):
+        countries = tuple(sorted(np.atleast_1d(request['countries'])))
+        if countries not in populations:
+            populations[countries] = await asyncio.get_running_loop().run_in_executor(
+                executor, prepare, input_path, interim_path, countries
+            )
+        mapped_population, wind = populations[countries]
+
+        years = range(int(request['year_start']), int(request['year_end']) + 1)
+        if not len(years):
+            raise ValueError('year_end is before year_start.')
+
+        descriptors = []
+        try:
+            for year in years:
+                descriptors.append((year, await acquire(countries, year, mapped_population)))
+            live = [entry['descriptor']['name'] for entry in datasets.values()]
+            return await asyncio.get_running_loop().run_in_executor(
+                executor, compute, request, input_path, descriptors, mapped_population, wind, live
+            )
+        finally:
+            for year, _ in descriptors:
+                datasets[(countries, year)]['users'] -= 1
+                datasets[(countries, year)]['used'] = time.time()
+            evict(memory)
+
+    async def respond(writer, status, body, content_type='text/plain'):
+        writer.write('HTTP/1.1 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(
+            status, content_type, len(body)
+        ).encode() + body)
+        await writer.drain()
+
+    async def stream(writer, df):
+        df = df.set_axis(['_'.join(column[0:3]) for column in df.columns], axis=1)
+        df.index = pd.Index(write.timestamps(df.index)['utc'], name='utc_timestamp')
+
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/csv\r\nTransfer-Encoding: chunked\r\n'
+                     b'Connection: close\r\n\r\n')
+        for start in range(0, len(df), block_size):
+            data = df.iloc[start:start + block_size].to_csv(header=start == 0, float_format='%g').encode()
+            writer.write('{:x}\r\n'.format(len(data)).encode() + data + b'\r\n')
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def handle(reader, writer):
+        try:
+            method, target, _ = (await reader.readline()).decode().split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode()
+                if line.strip() == '':
+                    break
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if method == 'GET' and target == '/status':
+                status = [{'countries': list(key[0]), 'year': key[1], 'bytes': entry['nbytes'],
+                           'users': entry['users'], 'idle': round(time.time() - entry['used'])}
+                          for key, entry in datasets.items()]
+                await respond(writer, '200 OK', json.dumps(status).encode(), 'application/json')
+            elif method == 'POST' and target == '/compute':
+                try:
+                    df = await run(json.loads(body))
+                except (ValueError, KeyError, TypeError) as err:
+                    await respond(writer, '400 Bad Request', str(err).encode())
+                    return
+                await stream(writer, df)
+            else:
+                await respond(writer, '404 Not Found', b'')
+
+        except Exception as err:
+            await respond(writer, '500 Internal Server Error', repr(err).encode())
+        finally:
+            writer.close()
+
+    async def expire():
+        while True:
+            await asyncio.sleep(min(idle, 60))
+            evict(memory)
+
+    async def main():
+        server = await asyncio.start_server(handle, host, port)
+        print('Serving {} at http://{}:{}'.format(input_path, host, port))
+        task = asyncio.create_task(expire())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            task.cancel()
+
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        executor.shutdown()
+        evict(-1)
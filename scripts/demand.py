@@ -2,7 +2,8 @@
 import numpy as np
 import pandas as pd
 
-from scripts.misc import localize, upsample_df, group_df_by_multiple_column_levels
+import scripts.kernels as kernels
+from scripts.misc import localize, upsample_df, model_resolution, is_coarse, complete_steps, column_vector
 
 
 def reference_temperature(temperature):
@@ -10,23 +11,33 @@ def reference_temperature(temperature):
     # Daily average
     daily_average = temperature.groupby(pd.Grouper(freq='D')).mean().copy()
 
+    if kernels.backend != 'pandas' and not daily_average.isna().values.any():
+        return pd.DataFrame(kernels.reference(daily_average.to_numpy()),
+                            index=daily_average.index, columns=daily_average.columns)
+
     # Weighted mean
     return sum([.5 ** i * daily_average.shift(i).fillna(method='bfill') for i in range(4)]) / \
            sum([.5 ** i for i in range(4)])
 
 
-def adjust_temperature(temperature, heating_thresholds):
+def adjust_temperature(temperature, heating_thresholds, inplace=False):
 
     # Difference as compared to Germany
     diff = heating_thresholds - heating_thresholds['DE']
 
-    # Shift reference temperature by this difference
-    adjusted = temperature.copy()
+    # Shift reference temperature by this difference, which is expanded to the columns and subtracted at once
+    shift = column_vector(temperature.columns, diff).astype(np.result_type(*temperature.dtypes))
+
+    if not inplace:
+        return temperature - shift
 
-    for country in temperature.columns.get_level_values(0).unique():
-        adjusted[country] = temperature[country] - diff[country]
+    # For frames of a single data type, the values are a view and can be shifted without copies
+    values = temperature.values
+    values -= shift
+    if not np.may_share_memory(values, temperature.values):
+        temperature.loc[:, :] = values
 
-    return adjusted
+    return temperature
 
 
 def daily_heat(temperature, wind, all_parameters):
@@ -42,13 +53,12 @@ def daily_heat(temperature, wind, all_parameters):
                 1 + (parameters['B'] / (celsius - 40)) ** parameters['C']
         ) + parameters['D']
 
-        linear = pd.DataFrame(
-            [parameters['m_{}'.format(i)] * celsius + parameters['b_{}'.format(i)] for i in ['s', 'w']]
-        ).max()
+        # Element-wise maximum of both lines, which are missing together where the temperature is missing
+        linear = np.maximum(*[parameters['m_{}'.format(i)] * celsius + parameters['b_{}'.format(i)] for i in ['s', 'w']])
 
         return sigmoid + linear
 
-    return daily(temperature, wind, all_parameters, heat_function)
+    return daily(temperature, wind, all_parameters, heat_function, kernels.heat)
 
 
 def daily_water(temperature, wind, all_parameters):
@@ -65,22 +75,36 @@ def daily_water(temperature, wind, all_parameters):
 
         return parameters['m_w'] * celsius + parameters['b_w'] + parameters['D']
 
-    return daily(temperature, wind, all_parameters, water_function)
+    return daily(temperature, wind, all_parameters, water_function, kernels.water)
+
+
+def windy(wind):
+
+    # Windy locations have an average wind speed above the threshold of 4.4 m/s
+    return wind > 4.4
 
 
-def daily(temperature, wind, all_parameters, func):
+def daily(temperature, wind, all_parameters, func, kernel=None):
 
-    # All locations are separated by the average wind speed with the threshold 4.4 m/s
+    def apply(df, parameters):
+
+        # The formula is applied column by column, or to all values at once with the kernel of the chosen backend
+        if kernels.backend == 'pandas' or kernel is None:
+            return df.apply(func, parameters=parameters)
+
+        return pd.DataFrame(kernel(df.to_numpy(), parameters), index=df.index, columns=df.columns)
+
+    # All locations are separated by the average wind speed
     windy_locations = {
-        'normal': wind[wind <= 4.4].index,
-        'windy': wind[wind > 4.4].index
+        'normal': wind[~windy(wind)].index,
+        'windy': wind[windy(wind)].index
     }
 
     buildings = ['SFH', 'MFH', 'COM']
 
     return pd.concat(
         [pd.concat(
-            [temperature[locations].apply(func, parameters=all_parameters[(building, windiness)])
+            [apply(temperature[locations], all_parameters[(building, windiness)])
              for windiness, locations in windy_locations.items()],
             axis=1
         ) for building in buildings],
@@ -88,76 +112,98 @@ def daily(temperature, wind, all_parameters, func):
     )
 
 
-def hourly_heat(daily_df, temperature, parameters):
+def heat_classes(temperature):
 
     # According to BGW 2006, temperature classes are derived from the temperature data
-    # This is re-sampled to a 60-min-resolution and passed to the general hourly function
+    if kernels.backend != 'pandas':
+        return pd.DataFrame(kernels.classes(temperature.to_numpy(dtype='float64')),
+                            index=temperature.index, columns=temperature.columns)
 
-    classes = upsample_df(
-        (np.ceil(((temperature - 273.15) / 5).astype('float64')) * 5).clip(lower=-15, upper=30),
-        '60min'
-    ).astype(int).astype(str)
+    return (np.ceil(((temperature - 273.15) / 5).astype('float64')) * 5).clip(lower=-15, upper=30)
 
-    return hourly(daily_df, classes, parameters)
 
-
-def hourly_water(daily_df, temperature, parameters):
+def water_classes(temperature):
 
     # For water heating, the highest temperature classes '30' is chosen
-    # This is re-sampled to a 60-min-resolution and passed to the general hourly function
+    return pd.DataFrame(30, index=temperature.index, columns=temperature.columns)
 
-    classes = upsample_df(
-        pd.DataFrame(30, index=temperature.index, columns=temperature.columns),
-        '60min'
-    ).astype(int).astype(str)
 
-    return hourly(daily_df, classes, parameters)
+def hourly_heat(daily_df, temperature, parameters, resolution='60min'):
 
+    # The temperature classes are passed to the general hourly function together with the target resolution
+    return hourly(daily_df, heat_classes(temperature), parameters, resolution)
 
-def hourly(daily_df, classes, parameters):
 
-    def hourly_factors(building, country_classes):
+def hourly_water(daily_df, temperature, parameters, resolution='60min'):
 
-        # This function selects hourly factors from BGW 2006 by time and temperature class
-        slp = pd.DataFrame(index=country_classes.index, columns=country_classes.columns)
+    # The temperature classes are passed to the general hourly function together with the target resolution
+    return hourly(daily_df, water_classes(temperature), parameters, resolution)
 
-        # Time includes the hour of the day
-        times = country_classes.index.map(lambda x: x.strftime('%H:%M'))
 
-        # For commercial buildings, time additionally includes the weekday
-        if building == 'COM':
-            weekdays = country_classes.index.map(lambda x: int(x.strftime('%w')))
-            times = list(zip(weekdays, times))
-
-        for column in country_classes.columns:
-            slp[column] = parameters[building].lookup(times, country_classes.loc[:, column])
-
-        return slp
-
-    country_results = {}
-    # Upsample daily_df to 60 minutes
-    upsampled = upsample_df(daily_df, '60min')
+def hourly(daily_df, classes, parameters, resolution='60min', factors=None):
 
     countries = daily_df.columns.get_level_values('country').unique()
     buildings = daily_df.columns.get_level_values('building').unique()
 
-        
+    # The factors only depend on the temperature classes and may be passed if they are reused
+    if factors is None:
+        factors = hourly_factors(classes, parameters, buildings, resolution)
+
+    # Upsample daily_df to the resolution of the factors
+    upsampled = upsample_df(daily_df, factors.index[1] - factors.index[0], 'D')
+
+    country_results = {}
     for country in countries:
         print(country)
         country_results[country] = pd.concat(
-            [upsampled[building][country] * hourly_factors(building, classes[country])
+            [upsampled[building][country] * factors[country][building]
                 for building in buildings],
             keys=buildings, names=['building', 'latitude', 'longitude'], axis=1
         )
 
-    results = pd.concat(
+    return pd.concat(
         country_results.values(), keys=countries, names=['country', 'building', 'latitude', 'longitude'], axis=1
     )
 
-    return results
 
+def hourly_factors(classes, parameters, buildings, resolution='60min'):
+
+    # Upsample classes to the (sub-)hourly resolution, in which coarser resolutions are aggregated later on
+    classes = upsample_df(classes, model_resolution(resolution), 'D').astype(int)
+    countries = classes.columns.get_level_values('country').unique()
+
+    # Time includes the hour of the day (sub-hourly time steps use the factor of the respective hour)
+    # For commercial buildings, time additionally includes the weekday (from 0 on Sunday)
+    times = classes.index.floor('60min').strftime('%H:%M')
+    weekdays = (classes.index.dayofweek + 1) % 7
+
+    def select(building, country_classes):
+
+        # This function selects hourly factors from BGW 2006 by time and temperature class
+        # The factors of all locations are taken at once by the positions of their times and classes in the table
+        table = parameters[building]
+        rows = table.index.get_indexer(pd.MultiIndex.from_arrays([weekdays, times]) if building == 'COM' else times)
+        columns = table.columns.astype(int).get_indexer(country_classes.to_numpy().ravel())
+        if (rows < 0).any() or (columns < 0).any():
+            raise KeyError('Hourly factors of {} are missing for some times or temperature classes.'.format(building))
+
+        return pd.DataFrame(table.to_numpy()[rows[:, None], columns.reshape(country_classes.shape)],
+                            index=country_classes.index, columns=country_classes.columns)
+
+    return pd.concat(
+        [pd.concat(
+            [select(building, classes[country]) for building in buildings],
+            keys=buildings, names=['building', 'latitude', 'longitude'], axis=1
+        ) for country in countries],
+        keys=countries, names=['country', 'building', 'latitude', 'longitude'], axis=1
+    )
+
+
+def finishing(df, mapped_population, building_database, energy=None):
 
-def finishing(df, mapped_population, building_database):
+    # The energy per year by country and building type (see yearly_energy) may be given for other years than those of
+    # df, e.g., of all years if the years are processed in chunks (see pipeline.chunked). The scaling to 1 TWh/a and to
+    # the building database then refers to these years.
 
     # Single- and multi-family houses are aggregated assuming a ratio of 70:30
     # Transforming to heat demand assuming an average conversion efficiency of 0.9
@@ -167,6 +213,9 @@ def finishing(df, mapped_population, building_database):
         'COM': building_database['Tertiary']
     }
 
+    # Time series are in MW, so that the energy of each value depends on the length of the (regular) time steps
+    hours = (df.index[1] - df.index[0]) / pd.Timedelta('60min')
+
     results = []
     for country, population in mapped_population.items():
 
@@ -182,14 +231,15 @@ def finishing(df, mapped_population, building_database):
 
             # Scaling to 1 TWh/a
             years = df_cb.index.year.unique()
-            factor = 1000000 / df_cb.sum().sum() * len(years)
+            yearly = energy_by_year(df_cb, hours) if energy is None else energy[(country, building_type)]
+            factor = 1000000 / yearly.sum() * len(yearly)
             normalized.append(df_cb.multiply(factor))
 
             # Scaling to building database
             if country not in ['CH', 'NO']:
                 database_years = building_data.columns
                 factors = pd.Series([
-                    building_data.loc[country, str(year)] * 1000000 / df_cb.loc[df_cb.index.year == year, ].sum().sum()
+                    building_data.loc[country, str(year)] * 1000000 / yearly[year]
                     if str(year) in database_years else float('nan')
                     for year in years
                 ], index=years)
@@ -216,46 +266,112 @@ def finishing(df, mapped_population, building_database):
                      names=['country', 'unit', 'building_type', 'latitude', 'longitude'])
 
 
-def combine(space, water):
-
-    # Spatial aggregation
-    space = group_df_by_multiple_column_levels(space, ['country', 'unit', 'building_type'])
-    water = group_df_by_multiple_column_levels(water, ['country', 'unit', 'building_type'])
-
-    # Merge space and water
-    df = pd.concat([space, water], axis=1, keys=['space', 'water'],
-                   names=['attribute', 'country', 'unit', 'building_type'])
+def yearly_energy(df, mapped_population):
 
-    # Aggregation of building types for absolute values
-    dfx = df.loc[:, df.columns.get_level_values('unit') == 'MW']
-    dfx = dfx.groupby(dfx.columns.droplevel('building_type'), axis=1).sum()
-    dfx.columns = pd.MultiIndex.from_tuples(dfx.columns)
-    dfx = pd.concat([dfx['space'], dfx['water'], dfx['space'] + dfx['water']], axis=1,
-                    keys=['space', 'water', 'total'], names=['attribute', 'country', 'unit'])
+    # Energy of the weighted time series per year (in local time) by country and building type as in finishing
+    hours = (df.index[1] - df.index[0]) / pd.Timedelta('60min')
 
-    # Rename columns
-    df.columns = pd.MultiIndex.from_tuples(
-        [('_'.join([level for level in [col_name[0], col_name[3]]]), col_name[1], col_name[2])
-         for col_name in df.columns.values]
-    )
-
-    # Combine building-specific and aggregated time series, round, restore nan
-    df = pd.concat([dfx, df], axis=1).round()
-    df.replace(0, float('nan'), inplace=True)
-
-    # Fill NA at the end and the beginning of the dataset arising from different local times
-    df_short = df.loc[:, df.columns.get_level_values('unit') == 'MW'].copy().dropna(how='all')
-    df = df.fillna(method='bfill').fillna(method='ffill')
-    df[df_short.columns] = df_short.fillna(method='bfill').fillna(method='ffill')
-
-    # Swap MultiIndex
-    df = pd.concat([
-        df.loc[:, df.columns.get_level_values('unit') == 'MW'],
-        df.loc[:, df.columns.get_level_values('unit') == 'MW/TWh']
-    ], axis=1, keys=['heat_demand', 'heat_profile'])
-    df = df.swaplevel(i=0, j=2, axis=1)
-    df = df.swaplevel(i=1, j=2, axis=1)
-    df = df.sort_index(level=0, axis=1)
-    df.columns.names = ['country', 'variable', 'attribute', 'unit']
-
-    return df
+    energy = {}
+    for country, population in mapped_population.items():
+        df_country = localize(df[country], country)
+        for building_type in df_country.columns.get_level_values('building').unique():
+            energy[(country, building_type)] = energy_by_year(df_country[building_type] * population, hours)
+
+    return pd.DataFrame(energy)
+
+
+def energy_by_year(df, hours):
+
+    # Sum over all columns and the time steps of each year, which are all of the same length in hours
+    return df.sum(axis=1).groupby(df.index.year).sum() * hours
+
+
+def normalization_factors(energy):
+
+    # Same scaling to 1 TWh/a as in finishing, i.e., on average over all years of the yearly energy
+    return 1000000 / energy.sum() * len(energy)
+
+
+def combine(space, water, resolution='60min', rounded=True, partial_steps=False):
+
+    # The output columns are set up once in their final order and each aggregated time series is written directly
+    # into a preallocated array. Sums are NaN-aware, i.e., they are missing only if all summands are missing.
+    index = space.index.union(water.index)
+    dtype = np.result_type(*space.dtypes, *water.dtypes)
+
+    # Positions of the grid cells for each country, unit and building type
+    cells = {}
+    for attribute, df in [('space', space), ('water', water)]:
+        for i, (country, unit, building_type) in enumerate(
+                df.columns.droplevel(['latitude', 'longitude']).reorder_levels(['country', 'unit', 'building_type'])
+        ):
+            cells.setdefault((attribute, country, unit), {}).setdefault(building_type, []).append(i)
+
+    # Building-specific time series and, for absolute values, their aggregates by attribute and in total
+    columns = []
+    for (attribute, country, unit), building_types in cells.items():
+        variable = 'heat_demand' if unit == 'MW' else 'heat_profile'
+        columns += [(country, variable, '_'.join([attribute, building_type]), unit) for building_type in building_types]
+        if unit == 'MW':
+            columns += [(country, variable, attribute, unit), (country, variable, 'total', unit)]
+    columns = pd.MultiIndex.from_tuples(sorted(set(columns)), names=['country', 'variable', 'attribute', 'unit'])
+    position = {column: i for i, column in enumerate(columns)}
+
+    results = np.full((len(index), len(columns)), np.nan, dtype=dtype)
+
+    def nansum(values):
+        result = np.nansum(values, axis=1, dtype='float64')
+        result[np.isnan(values).all(axis=1)] = np.nan
+        return result
+
+    values = {'space': space.reindex(index, copy=False).to_numpy(),
+              'water': water.reindex(index, copy=False).to_numpy()}
+    for (attribute, country, unit), building_types in cells.items():
+        variable = 'heat_demand' if unit == 'MW' else 'heat_profile'
+        for building_type, positions in building_types.items():
+            results[:, position[(country, variable, '_'.join([attribute, building_type]), unit)]] = \
+                nansum(values[attribute][:, positions])
+        if unit == 'MW':
+            results[:, position[(country, variable, attribute, unit)]] = nansum(results[:, [
+                position[(country, variable, '_'.join([attribute, building_type]), unit)]
+                for building_type in building_types
+            ]])
+
+    for country, variable, attribute, unit in columns[columns.get_level_values('attribute') == 'total']:
+        results[:, position[(country, variable, attribute, unit)]] = nansum(results[:, [
+            position[(country, variable, part, unit)] for part in ['space', 'water']
+            if (country, variable, part, unit) in position
+        ]])
+
+    # Resolutions above one hour are aggregated from the hourly values in UTC, where the time steps of all countries
+    # are aligned, as the average power of each time step. The first and last time step are dropped if the hourly
+    # values cover them only partly, unless they are kept to be joined with other parts (see batch.merge).
+    if is_coarse(resolution):
+        aggregated = pd.DataFrame(results, index=index, columns=columns, copy=False).resample(resolution).mean()
+        if not partial_steps:
+            aggregated = aggregated.loc[complete_steps(index, resolution)]
+        index = aggregated.index
+        results = aggregated.to_numpy(dtype=dtype)
+
+    # The values may be kept unrounded if they are scaled further (see batch.merge)
+    if rounded:
+        np.round(results, out=results)
+
+    fill_edges(results, columns.get_level_values('unit') == 'MW')
+
+    return pd.DataFrame(results, index=index, columns=columns)
+
+
+def fill_edges(results, absolute):
+
+    # Fill NA at the end and the beginning of the dataset arising from different local times in place. Absolute values
+    # are only filled within the rows, in which any absolute values are available. Zeros, e.g., of space heating in
+    # summer, are kept.
+    valid = ~np.isnan(results)
+    rows = np.flatnonzero(valid[:, absolute].any(axis=1)) if absolute.any() else []
+    for i in np.flatnonzero(valid.any(axis=0)):
+        start, end = (rows[0], rows[-1] + 1) if absolute[i] else (0, len(results))
+        first = np.argmax(valid[:, i])
+        last = len(results) - np.argmax(valid[::-1, i])
+        results[start:first, i] = results[first, i]
+        results[last:end, i] = results[last - 1, i]
@@ -4,12 +4,13 @@ import ssl
 import datetime
 import urllib
 import zipfile
-import cdsapi
-from IPython.display import clear_output
 
 
 
 def wind(input_path):
+
+    from IPython.display import clear_output
+
     filename = 'ERA_wind.nc'
     weather_path = os.path.join(input_path, 'weather')
     os.makedirs(weather_path, exist_ok=True)
@@ -39,6 +40,8 @@ def wind(input_path):
 
 def temperatures(input_path, year_start, year_end):
 
+    from IPython.display import clear_output
+
     for year in ["%.2d" % y for y in range(year_start, year_end+1)]:
         for variable in ['2m_temperature', 'soil_temperature_level_1']:
 
@@ -73,6 +76,9 @@ def weather(data_package, variable, dates, product_type, file):
     # if not os.environ.get('PYTHONHTTPSVERIFY', '') and getattr(ssl, '_create_unverified_context', None):
     #   ssl._create_default_https_context = ssl._create_unverified_context
 
+    # The CDS API client is only needed (and imported) for actual downloads
+    import cdsapi
+
     c = cdsapi.Client()
 
     params = {
@@ -92,6 +98,8 @@ def weather(data_package, variable, dates, product_type, file):
 
 def population(input_path):
 
+    from IPython.display import clear_output
+
     # Set URL and directories
     url = 'https://ec.europa.eu/eurostat/cache/GISCO/geodatafiles/GEOSTAT-grid-POP-1K-2011-V2-0-1.zip'
     population_path = os.path.join(input_path, 'population')
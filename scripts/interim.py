@@ -0,0 +1,161 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+
+
+# Interim results are stored in a directory with the values as column-major NumPy array and the row and column
+# index in sidecar files. The values can be memory-mapped and columns can be read selectively, e.g., by country.
+
+
+def save(df, path):
+
+    series = isinstance(df, pd.Series)
+    name = df.name if series else None
+    if series:
+        df = df.to_frame()
+
+    # The values are stored as one array, which cannot be loaded (or memory-mapped) if it holds Python objects
+    values = df.to_numpy()
+    if values.dtype == object:
+        raise TypeError('Interim data must have a single numeric data type, got {}.'.format(
+            ', '.join(sorted({str(dtype) for dtype in df.dtypes}))
+        ))
+
+    save_labels(df.index, df.columns, path, series, name)
+    np.save(os.path.join(path, 'values.npy'), np.asfortranarray(values))
+
+
+def allocate(path, index, columns, dtype='float64'):
+
+    # For data written block by block (e.g., from files that do not fit into memory), the values are allocated as
+    # writable memory-map, which is filled by the caller
+    save_labels(index, columns, path)
+
+    return np.lib.format.open_memmap(os.path.join(path, 'values.npy'), mode='w+', dtype=dtype,
+                                     shape=(len(index), len(columns)), fortran_order=True)
+
+
+def save_labels(index, columns, path, series=False, name=None):
+
+    # Files of the former pickle format are replaced
+    if os.path.isfile(path):
+        os.remove(path)
+    os.makedirs(path, exist_ok=True)
+
+    index_arrays, index_meta = encode(index)
+    column_arrays, column_meta = encode(columns)
+
+    np.savez(os.path.join(path, 'index.npz'), **index_arrays)
+    np.savez(os.path.join(path, 'columns.npz'), **column_arrays)
+
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'series': series, 'name': name, 'index': index_meta, 'columns': column_meta}, f, indent=1)
+
+
+def load(path, mmap=True, **selection):
+
+    # Columns can be selected by level values, e.g., load(path, country=['DE', 'FR'], building_type='SFH')
+    # Memory-mapped values are read-only, so that they cannot be changed in place, e.g., by
+    # demand.adjust_temperature(..., inplace=True). With mmap='copy', they are mapped copy-on-write, i.e., changes are
+    # kept in memory without being written to the file. With mmap=False, all values are read into memory.
+
+    # Files of the former pickle format are still read
+    if os.path.isfile(path):
+        df = pd.read_pickle(path)
+        if isinstance(df, pd.Series):
+            return df.loc[select(df.index, selection)]
+        return df.loc[:, select(df.columns, selection)]
+
+    with open(os.path.join(path, 'meta.json')) as f:
+        meta = json.load(f)
+    with np.load(os.path.join(path, 'index.npz')) as arrays:
+        index = decode(arrays, meta['index'])
+    with np.load(os.path.join(path, 'columns.npz')) as arrays:
+        columns = decode(arrays, meta['columns'])
+
+    values = np.load(os.path.join(path, 'values.npy'), mmap_mode={True: 'r', 'copy': 'c', False: None}[mmap])
+
+    # Due to the column-major order, each selected column is read from disk in one piece
+    if selection:
+        mask = select(columns, selection)
+        values = values[:, mask]
+        columns = columns[mask]
+
+    df = pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+    # Names of Series taken from MultiIndex columns are tuples, which are stored as lists
+    name = tuple(meta['name']) if isinstance(meta['name'], list) else meta['name']
+
+    return df.iloc[:, 0].rename(name) if meta['series'] else df
+
+
+def exists(path):
+
+    return os.path.exists(path)
+
+
+def select(labels, selection):
+
+    mask = np.ones(len(labels), dtype=bool)
+    for level, values in selection.items():
+        mask &= labels.get_level_values(level).isin(np.atleast_1d(values))
+
+    return mask
+
+
+def encode(index):
+
+    # Indices are stored by their levels and codes, so that MultiIndexes are restored exactly
+    multi = isinstance(index, pd.MultiIndex)
+    levels = index.levels if multi else [index]
+
+    arrays = {}
+    meta = {'multi': multi, 'names': list(index.names), 'levels': []}
+    for i, level in enumerate(levels):
+
+        if isinstance(level, pd.DatetimeIndex):
+            arrays['level_{}'.format(i)] = level.asi8
+            meta['levels'].append({
+                'kind': 'datetime',
+                'tz': str(level.tz) if level.tz is not None else None,
+                'freq': level.freqstr if not multi else None
+            })
+        elif level.dtype == object:
+            arrays['level_{}'.format(i)] = level.values.astype(str)
+            meta['levels'].append({'kind': 'string'})
+        else:
+            arrays['level_{}'.format(i)] = level.values
+            meta['levels'].append({'kind': 'numeric'})
+
+        if multi:
+            arrays['codes_{}'.format(i)] = index.codes[i]
+
+    return arrays, meta
+
+
+def decode(arrays, meta):
+
+    levels = []
+    for i, level_meta in enumerate(meta['levels']):
+
+        values = arrays['level_{}'.format(i)]
+
+        if level_meta['kind'] == 'datetime':
+            level = pd.DatetimeIndex(values.view('datetime64[ns]'))
+            if level_meta['tz'] is not None:
+                level = level.tz_localize('utc').tz_convert(level_meta['tz'])
+            if level_meta['freq'] is not None:
+                level.freq = level_meta['freq']
+        elif level_meta['kind'] == 'string':
+            level = pd.Index(values.astype(object))
+        else:
+            level = pd.Index(values)
+
+        levels.append(level)
+
+    if meta['multi']:
+        return pd.MultiIndex(levels=levels, codes=[arrays['codes_{}'.format(i)] for i in range(len(levels))],
+                             names=meta['names'])
+
+    return levels[0].rename(meta['names'][0])
@@ -0,0 +1,167 @@
+
+import numpy as np
+
+
+# Elementwise kernels of the demand and COP formulas, which operate on the values of (time x cell) DataFrames
+# The backend is chosen with use(): 'pandas' keeps the original DataFrame operations, 'numpy' evaluates each formula
+# on the arrays, and 'numba' compiles each formula chain into one parallel loop without intermediate arrays
+
+backend = 'pandas'
+
+_compiled = {}
+
+
+def use(name):
+
+    global backend
+
+    if name not in ['pandas', 'numpy', 'numba']:
+        raise ValueError('Unknown backend: {}'.format(name))
+
+    # Without Numba, the NumPy kernels are used
+    if name == 'numba' and compiled() is None:
+        print('Numba is not installed, the NumPy backend is used instead.')
+        name = 'numpy'
+
+    backend = name
+
+
+def compiled():
+
+    # Numba is imported and the kernels are compiled on first use
+    if not _compiled:
+        try:
+            import numba
+        except ImportError:
+            return None
+        _compiled.update(compile_kernels(numba))
+
+    return _compiled
+
+
+def heat(t, parameters):
+
+    # Daily heat demand according to BDEW et al. 2015 (see demand.daily_heat)
+    p = [float(parameters[name]) for name in ['A', 'B', 'C', 'D', 'm_s', 'b_s', 'm_w', 'b_w']]
+
+    if backend == 'numba':
+        return compiled()['heat'](t, *p).astype(t.dtype)
+
+    A, B, C, D, m_s, b_s, m_w, b_w = p
+    celsius = t - 273.15
+    return (A / (1 + (B / (celsius - 40)) ** C) + D
+            + np.maximum(m_s * celsius + b_s, m_w * celsius + b_w)).astype(t.dtype)
+
+
+def water(t, parameters):
+
+    # Daily water heating demand, constant below 15 °C (see demand.daily_water)
+    p = [float(parameters[name]) for name in ['m_w', 'b_w', 'D']]
+
+    if backend == 'numba':
+        return compiled()['water'](t, *p).astype(t.dtype)
+
+    m_w, b_w, D = p
+    return (m_w * np.maximum(t - 273.15, 15) + b_w + D).astype(t.dtype)
+
+
+def classes(t):
+
+    # Temperature classes according to BGW 2006 (see demand.heat_classes)
+    if backend == 'numba':
+        return compiled()['classes'](t)
+
+    return np.clip(np.ceil((t - 273.15) / 5) * 5, -15, 30)
+
+
+def cop(sink, source, coefficients):
+
+    # Quadratic COP curve of the temperature difference, which is at least 15 K (see cop.spatial_cop)
+    p = [float(coefficients[i]) for i in range(3)]
+
+    if backend == 'numba':
+        return compiled()['cop'](sink, source, *p).astype(sink.dtype)
+
+    delta_t = np.maximum(sink - source, 15)
+    return (p[0] + p[1] * delta_t + p[2] * delta_t ** 2).astype(sink.dtype)
+
+
+def reference(daily):
+
+    # Weighted mean of the daily averages of the current and the three preceding days (see
+    # demand.reference_temperature), where the first day is used in place of the days before the start
+    weights = [.5 ** i for i in range(4)]
+
+    if backend == 'numba':
+        return compiled()['reference'](daily, np.array(weights)).astype(daily.dtype)
+
+    rows = np.arange(daily.shape[0])
+    return sum(weight * daily[np.maximum(rows - i, 0)] for i, weight in enumerate(weights)) / sum(weights)
+
+
+def compile_kernels(numba):
+
+    # NaN propagates from either argument as with np.maximum and np.minimum, whereas the built-in max and min return
+    # one of the arguments depending on their order
+    @numba.njit
+    def maximum(a, b):
+        return a if a >= b or np.isnan(a) else b
+
+    @numba.njit
+    def minimum(a, b):
+        return a if a <= b or np.isnan(a) else b
+
+    @numba.njit(parallel=True, cache=True)
+    def heat_kernel(t, A, B, C, D, m_s, b_s, m_w, b_w):
+        out = np.empty(t.shape)
+        for j in numba.prange(t.shape[1]):
+            for i in range(t.shape[0]):
+                celsius = t[i, j] - 273.15
+                out[i, j] = A / (1 + (B / (celsius - 40)) ** C) + D \
+                    + maximum(m_s * celsius + b_s, m_w * celsius + b_w)
+        return out
+
+    @numba.njit(parallel=True, cache=True)
+    def water_kernel(t, m_w, b_w, D):
+        out = np.empty(t.shape)
+        for j in numba.prange(t.shape[1]):
+            for i in range(t.shape[0]):
+                out[i, j] = m_w * maximum(t[i, j] - 273.15, 15.) + b_w + D
+        return out
+
+    @numba.njit(parallel=True, cache=True)
+    def classes_kernel(t):
+        out = np.empty(t.shape)
+        for j in numba.prange(t.shape[1]):
+            for i in range(t.shape[0]):
+                out[i, j] = minimum(maximum(np.ceil((t[i, j] - 273.15) / 5) * 5, -15.), 30.)
+        return out
+
+    @numba.njit(parallel=True, cache=True)
+    def cop_kernel(sink, source, a, b, c):
+        out = np.empty(sink.shape)
+        for j in numba.prange(sink.shape[1]):
+            for i in range(sink.shape[0]):
+                delta_t = maximum(sink[i, j] - source[i, j], 15.)
+                out[i, j] = a + b * delta_t + c * delta_t ** 2
+        return out
+
+    @numba.njit(parallel=True, cache=True)
+    def reference_kernel(daily, weights):
+        out = np.empty(daily.shape)
+        total = weights.sum()
+        for j in numba.prange(daily.shape[1]):
+            for i in range(daily.shape[0]):
+                value = 0.
+                for k in range(len(weights)):
+                    value += weights[k] * daily[max(i - k, 0), j]
+                out[i, j] = value / total
+        return out
+
+    return {
+        'heat': heat_kernel,
+        'water': water_kernel,
+        'classes': classes_kernel,
+        'cop': cop_kernel,
+        'reference': reference_kernel
+    }
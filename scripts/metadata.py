@@ -1,6 +1,5 @@
 
 import json
-import yaml
 import os
 import hashlib
 import shutil
@@ -226,7 +225,12 @@ country_map = {
 }
 
 
-def make_json(shaped_dfs, version, changes, year_start, year_end, output_path):
+def make_json(shaped_dfs, version, changes, year_start, year_end, output_path, hashes=None):
+
+    # Sizes and checksums computed while writing (see write.to_csv) are used instead of reading the files again
+    hashes = hashes or {}
+
+    import yaml
 
     # Header
     metadata = yaml.load(
@@ -235,10 +239,12 @@ def make_json(shaped_dfs, version, changes, year_start, year_end, output_path):
     )
 
     # List of resources (files included in the datapackage)
+    csv_name = next((name for name in hashes if name.startswith('when2heat.csv')), 'when2heat.csv')
     metadata['resources'] = [
-        get_resource(excel_resource, os.path.join(output_path, 'when2heat.xlsx')),
-        get_resource(csv_resource, os.path.join(output_path, 'when2heat.csv'))
+        get_resource(excel_resource, os.path.join(output_path, 'when2heat.xlsx'), hashes.get('when2heat.xlsx')),
+        get_resource(csv_resource, os.path.join(output_path, csv_name), hashes.get(csv_name))
     ]
+    metadata['resources'][1]['path'] = csv_name
 
     # List of fields
     for column in shaped_dfs['multiindex'].columns:
@@ -251,20 +257,23 @@ def make_json(shaped_dfs, version, changes, year_start, year_end, output_path):
         )
 
 
-def get_resource(template, file_path):
+def get_resource(template, file_path, file_hash=None):
 
-    file_size = os.path.getsize(file_path)
+    import yaml
 
-    with open(file_path, 'rb') as f:
-        file_hash = hashlib.md5(f.read()).hexdigest()
+    if file_hash is None:
+        with open(file_path, 'rb') as f:
+            file_hash = {'bytes': os.path.getsize(file_path), 'hash': hashlib.md5(f.read()).hexdigest()}
 
     return yaml.load(
-        template.format(bytes=file_size, hash=file_hash),  Loader=yaml.SafeLoader
+        template.format(bytes=file_hash['bytes'], hash=file_hash['hash']),  Loader=yaml.SafeLoader
     )
 
 
 def get_field(column):
 
+    import yaml
+
     country, variable, attribute, unit = column
 
     description = yaml.load(
@@ -282,17 +291,21 @@ def get_field(column):
     )
 
 
-def checksums(output_path, home_path):
+def checksums(output_path, home_path, hashes=None):
 
     os.chdir(output_path)
     files = os.listdir(output_path)
+    hashes = hashes or {}
 
     # Create checksums.txt in the output directory
     with open('checksums.txt', 'w') as f:
         for file_name in files:
-            if file_name.split('.')[-1] in ['csv', 'sqlite', 'xlsx']:
-                with open(file_name, 'rb') as fx:
-                    file_hash = hashlib.md5(fx.read()).hexdigest()
+            if file_name.split('.')[-1] in ['csv', 'sqlite', 'xlsx', 'gz', 'zst']:
+                if file_name in hashes:
+                    file_hash = hashes[file_name]['hash']
+                else:
+                    with open(file_name, 'rb') as fx:
+                        file_hash = hashlib.md5(fx.read()).hexdigest()
                 f.write('{},{}\n'.format(file_name, file_hash))
 
     # Copy the file to root directory from where it will be pushed to GitHub,
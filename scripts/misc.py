@@ -1,36 +1,73 @@
 
+import os
+import json
+import hashlib
 import pytz
+import numpy as np
 import pandas as pd
+from pandas.tseries.frequencies import to_offset
 
 
-def localize(df, country, ambiguous=None):
+# Localized time indices by country, which are reused for all time series on the same index (e.g., by the processes
+# of the compute service, see daemon)
+_localizations = {}
+
+
+def localize(df, country):
+
+    positions, index = localization(df.index, country)
+
+    if len(positions) != len(df.index) or (positions != np.arange(len(positions))).any():
+        df = df.iloc[positions]
+    df.index = index
+
+    return df
+
+
+def localization(index, country):
+
+    # The rows (by position) and the localized index are looked up by the time index, which is compared in full
+    key = (country, len(index), index[0] if len(index) else None, index[-1] if len(index) else None)
+    if key in _localizations and _localizations[key][0].equals(index):
+        return _localizations[key][1:]
+
+    localized = localize_positions(pd.Series(np.arange(len(index)), index=index), country)
+
+    # Only a few indices are kept, e.g., of the years of the requests of a compute service
+    if len(_localizations) >= 16:
+        _localizations.pop(next(iter(_localizations)))
+    _localizations[key] = (index, localized.to_numpy(), localized.index)
+
+    return _localizations[key][1:]
+
+
+def localize_positions(s, country, ambiguous=None):
 
     # The exceptions below correct for daylight saving time
     try:
-        df.index = df.index.tz_localize(pytz.country_timezones[country][0], ambiguous=ambiguous)
-        return df
+        s.index = s.index.tz_localize(pytz.country_timezones[country][0], ambiguous=ambiguous)
+        return s
 
     # Delete values that do not exist because of daylight saving time
     except pytz.NonExistentTimeError as err:
-        return localize(df.loc[df.index != err.args[0], ], country)
+        return localize_positions(s.loc[s.index != err.args[0], ], country)
 
     # Duplicate values that exist twice because of daylight saving time
     except pytz.AmbiguousTimeError as err:
         idx = pd.Timestamp(err.args[0].split("from ")[1].split(",")[0])
-        unambiguous_df = localize(df.loc[df.index != idx, ], country)
-        ambiguous_df = localize(df.loc[[idx, idx], ], country, ambiguous=[True, False])
-        return unambiguous_df.append(ambiguous_df).sort_index()
+        unambiguous_s = localize_positions(s.loc[s.index != idx, ], country)
+        ambiguous_s = localize_positions(s.loc[[idx, idx], ], country, ambiguous=[True, False])
+        return unambiguous_s.append(ambiguous_s).sort_index()
 
 
-def upsample_df(df, resolution):
+def upsample_df(df, resolution, freq):
 
     # The low-resolution values are applied to all high-resolution values up to the next low-resolution value
     # In particular, the last low-resolution value is extended up to where the next low-resolution value would be
+    # The original frequency is given, so that it is also known for a single low-resolution value (e.g., one day)
 
     df = df.copy()
-
-    # Determine the original frequency
-    freq = df.index[-1] - df.index[-2]
+    freq = pd.Timedelta(to_offset(freq))
 
     # Temporally append the DataFrame by one low-resolution value
     df.loc[df.index[-1] + freq, :] = df.iloc[-1, :]
@@ -44,9 +81,86 @@ def upsample_df(df, resolution):
     return df
 
 
+def column_vector(columns, values, level='country'):
+
+    # Scalar parameters (e.g., per country) are looked up once per distinct label and expanded by the level codes
+    if isinstance(columns, pd.MultiIndex):
+        position = columns.names.index(level)
+        return values.reindex(columns.levels[position]).to_numpy()[columns.codes[position]]
+
+    return values.reindex(columns).to_numpy()
+
+
+def is_coarse(resolution):
+
+    # Resolutions above one hour, including calendar frequencies (e.g., 'W' or 'M')
+    offset = to_offset(resolution)
+
+    return not isinstance(offset, pd.offsets.Tick) or offset > pd.offsets.Hour()
+
+
+def model_resolution(resolution):
+
+    # Heat demand and COP are calculated in the resolution if it is one hour or finer and hourly otherwise. Coarser
+    # resolutions are aggregated from the hourly values after the conversion to UTC (see demand.combine and
+    # cop.finishing), so that the time steps of all countries are aligned.
+    return '60min' if is_coarse(resolution) else resolution
+
+
+def complete_steps(index, resolution):
+
+    # Labels of the coarse time steps (as of resample), which are completely covered by the regular index, i.e., not
+    # the first and last time step if the index starts or ends within them. The counts of the index values in each
+    # time step are compared to those of an index extended by more than the longest time step (a year) on both sides.
+    step = index[1] - index[0]
+    counts = pd.Series(1, index=index).resample(resolution).count()
+    extended = pd.date_range(index[0] - pd.Timedelta('367D'), index[-1] + pd.Timedelta('367D'), freq=step)
+    full_counts = pd.Series(1, index=extended).resample(resolution).count()
+
+    return counts.index[counts.to_numpy() == full_counts.reindex(counts.index).to_numpy()]
+
+
+def divides_years(resolution):
+
+    # Resolutions, whose time steps do not extend over the turn of the year, so that years can be aggregated
+    # separately (e.g., '3H', 'D' or 'M', but not 'W' or '2D')
+    offset = to_offset(resolution)
+    if isinstance(offset, pd.offsets.Tick):
+        return pd.Timedelta('1D') % pd.Timedelta(offset) == pd.Timedelta(0)
+
+    return offset.n == 1 and isinstance(offset, (pd.offsets.MonthEnd, pd.offsets.MonthBegin, pd.offsets.QuarterEnd,
+                                                 pd.offsets.QuarterBegin, pd.offsets.YearEnd, pd.offsets.YearBegin))
+
+
 def group_df_by_multiple_column_levels(df, column_levels):
 
     df = df.groupby(df.columns.droplevel(list(set(df.columns.names) - set(column_levels))), axis=1).sum()
     df.columns = pd.MultiIndex.from_tuples(df.columns, names=column_levels)
 
     return df
+
+
+def checksum(file, interim_path):
+
+    # MD5 checksums of large input files are cached by file size and modification time
+    cache_file = os.path.join(interim_path, 'checksums.json')
+    cache = {}
+    if os.path.isfile(cache_file):
+        with open(cache_file) as f:
+            cache = json.load(f)
+
+    stat = os.stat(file)
+    key = os.path.realpath(file)
+    if key in cache and cache[key]['size'] == stat.st_size and cache[key]['mtime'] == stat.st_mtime_ns:
+        return cache[key]['md5']
+
+    md5 = hashlib.md5()
+    with open(file, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 24), b''):
+            md5.update(block)
+
+    cache[key] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'md5': md5.hexdigest()}
+    with open(cache_file, 'w') as f:
+        json.dump(cache, f, indent=1)
+
+    return cache[key]['md5']
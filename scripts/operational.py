@@ -0,0 +1,162 @@
+import os
+import sqlite3
+import pandas as pd
+
+import scripts.read as read
+import scripts.preprocess as preprocess
+import scripts.demand as demand
+import scripts.cop as cop
+import scripts.write as write
+from scripts.misc import localize, group_df_by_multiple_column_levels
+
+
+def initialize(parameters, interim_path, temperature, hourly_space, hourly_water, mapped_population, wind,
+               history=30):
+
+    # The state comprises everything that is needed to compute further days without a full rebuild:
+    # The daily average temperatures of the last days (for the reference temperature), the normalization factors
+    # of the full run (to scale the new hours consistently), the population weights, wind, and parameters (e.g.,
+    # pipeline.parameters). Days are kept for the given history, so that new data (e.g., an updated forecast) may
+    # start up to history - 3 days before the last day, as the reference temperature requires three preceding days.
+    state = {
+        'daily_average': temperature['air'].groupby(pd.Grouper(freq='D')).mean().iloc[-history:],
+        'history': history,
+        'factors': {
+            'space': normalization_factors(hourly_space, mapped_population),
+            'water': normalization_factors(hourly_water, mapped_population)
+        },
+        'mapped_population': mapped_population,
+        'wind': wind,
+        'parameters': parameters
+    }
+    pd.to_pickle(state, os.path.join(interim_path, 'operational_state'))
+
+
+def normalization_factors(df, mapped_population):
+
+    # Same scaling to 1 TWh/a as in demand.finishing, i.e., on average over all years of the full run
+    return demand.normalization_factors(demand.yearly_energy(df, mapped_population))
+
+
+def forecast(input_path, filenames, mapped_population):
+
+    # Reads new temperature data in the same layout as preprocess.temperature,
+    # filenames being a dictionary with netCDF files for 't2m' and 'stl1' in the weather directory
+    parameters = {
+        'air': 't2m',
+        'soil': 'stl1'
+    }
+
+    return pd.concat(
+        [preprocess.filter_countries(read.weather(input_path, filenames[parameter], parameter), mapped_population)
+         for parameter in parameters.values()],
+        keys=parameters.keys(), names=['parameter', 'country', 'latitude', 'longitude'], axis=1
+    )
+
+
+def append(temperature, interim_path, output_path, home_path):
+
+    # The new temperature data must cover whole days in the layout of preprocess.temperature
+    state_file = os.path.join(interim_path, 'operational_state')
+    state = pd.read_pickle(state_file)
+    parameters = state['parameters']
+    mapped_population = state['mapped_population']
+
+    # Days, which have already been appended, are recomputed from the new data, but there must not be a gap to the
+    # last day of the state
+    new_average = temperature['air'].groupby(pd.Grouper(freq='D')).mean()
+    first_day = new_average.index[0]
+    last_day = state['daily_average'].index[-1]
+    if first_day > last_day + pd.Timedelta('1D'):
+        raise ValueError('The new data starts on {:%Y-%m-%d}, but the last day appended is {:%Y-%m-%d}.'.format(
+            first_day, last_day
+        ))
+    preceding = state['daily_average'].loc[state['daily_average'].index < first_day, ]
+    if len(preceding) < 3:
+        raise ValueError('The new data starts on {:%Y-%m-%d}, but the three preceding days are not kept in the '
+                         'state, which starts on {:%Y-%m-%d}.'.format(first_day, state['daily_average'].index[0]))
+
+    # Reference temperature continued from the daily averages of the preceding days
+    daily_average = pd.concat([preceding, new_average], axis=0)
+    reference_temperature = demand.reference_temperature(daily_average).loc[first_day:, ]
+    adjusted_temperature = demand.adjust_temperature(reference_temperature, parameters['heating_thresholds'])
+
+    # Daily and hourly heat demand of the new days only
+    daily_heat = demand.daily_heat(adjusted_temperature, state['wind'], parameters['daily_parameters'])
+    daily_water = demand.daily_water(adjusted_temperature, state['wind'], parameters['daily_parameters'])
+    hourly_heat = demand.hourly_heat(daily_heat, reference_temperature, parameters['hourly_parameters'])
+    hourly_water = demand.hourly_water(daily_water, reference_temperature, parameters['hourly_parameters'])
+    hourly_space = (hourly_heat - hourly_water).clip(lower=0)
+
+    # Weighting and scaling with the normalization factors of the full run
+    spatial_space = normalizing(hourly_space, mapped_population, state['factors']['space'])
+    spatial_water = normalizing(hourly_water, mapped_population, state['factors']['water'])
+
+    # Heat profiles in the layout of demand.combine and COP in the layout of cop.finishing
+    final_heat = profiles(spatial_space, spatial_water)
+    spatial_cop = cop.spatial_cop(cop.source_temperature(temperature),
+                                  cop.sink_temperature(temperature),
+                                  parameters['cop_parameters'])
+    final_cop = cop.finishing(spatial_cop, spatial_space, spatial_water)
+
+    # The hours from the first new day in UTC, for which all countries are computed, replace those in the existing
+    # output. The earlier hours of countries east of UTC are already in the output.
+    start = pd.Timestamp(first_day).tz_localize('utc')
+    os.chdir(output_path)
+    with sqlite3.connect('when2heat.sqlite') as connection:
+        connection.execute('DELETE FROM when2heat WHERE utc_timestamp >= ?', (start.strftime('%Y-%m-%dT%H:%M:%SZ'), ))
+    os.chdir(home_path)
+
+    df = pd.concat([final_heat, final_cop], axis=1)
+    df = df.loc[df.index >= start, ]
+    shaped_dfs = write.shaping(df[final_heat.columns], df[final_cop.columns])
+    write.to_sql(shaped_dfs, output_path, home_path, if_exists='append')
+
+    # Update the state for the next call
+    state['daily_average'] = daily_average.iloc[-state['history']:]
+    pd.to_pickle(state, state_file)
+
+    return shaped_dfs
+
+
+def normalizing(df, mapped_population, factors):
+
+    results = []
+    for country, population in mapped_population.items():
+
+        # Localize Timestamps (including daylight saving time correction)
+        df_country = localize(df[country], country)
+        building_types = df_country.columns.get_level_values('building').unique()
+
+        results.append(pd.concat(
+            [df_country[building_type] * population * factors[(country, building_type)]
+             for building_type in building_types],
+            axis=1, keys=building_types
+        ).tz_convert('utc'))
+
+    df = pd.concat(results, keys=mapped_population.keys(), axis=1,
+                   names=['country', 'building_type', 'latitude', 'longitude'])
+
+    return pd.concat([df], keys=['MW/TWh'], axis=1,
+                     names=['unit', 'country', 'building_type', 'latitude', 'longitude']).swaplevel(0, 1, axis=1)
+
+
+def profiles(spatial_space, spatial_water):
+
+    # Spatial aggregation
+    df = pd.concat(
+        [group_df_by_multiple_column_levels(df, ['country', 'building_type'])
+         for df in [spatial_space, spatial_water]],
+        axis=1, keys=['space', 'water']
+    ).round()
+
+    # Fill NA at the end and the beginning arising from different local times
+    df = df.fillna(method='bfill').fillna(method='ffill')
+
+    df.columns = pd.MultiIndex.from_tuples(
+        [(country, 'heat_profile', '_'.join([attribute, building_type]), 'MW/TWh')
+         for attribute, country, building_type in df.columns.values],
+        names=['country', 'variable', 'attribute', 'unit']
+    )
+
+    return df.sort_index(level=0, axis=1)
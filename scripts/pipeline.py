@@ -0,0 +1,179 @@
+import time
+import numpy as np
+import pandas as pd
+from itertools import repeat
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import scripts.read as read
+import scripts.preprocess as preprocess
+import scripts.demand as demand
+import scripts.cop as cop
+import scripts.write as write
+from scripts.misc import divides_years
+
+
+def parameters(input_path):
+
+    return {
+        'heating_thresholds': read.heating_thresholds(input_path),
+        'daily_parameters': read.daily_parameters(input_path),
+        'hourly_parameters': read.hourly_parameters(input_path),
+        'building_database': read.building_database(input_path),
+        'cop_parameters': read.cop_parameters(input_path)
+    }
+
+
+def spatial(temperature, reference_temperature, wind, mapped_population, parameters, resolution='60min',
+            country_mean=False, energy=None):
+
+    # Optionally, the weather data is averaged per country (weighted by population) before computing heat demand
+    # and COP, which approximates the grid-cell method at a fraction of the cost (see error_report)
+    if country_mean:
+        temperature = preprocess.country_mean(temperature, mapped_population)
+        reference_temperature = preprocess.country_mean(reference_temperature, mapped_population)
+        wind = preprocess.country_mean(wind, mapped_population)
+        mapped_population = preprocess.country_population(mapped_population)
+
+    # Heat demand (see section 4 of the processing notebook)
+    # The yearly energy may be given by attribute, e.g., of all chunks (see chunked)
+    hourly_space, hourly_water = hourly(reference_temperature, wind, parameters, resolution)
+
+    spatial_space = demand.finishing(hourly_space, mapped_population, parameters['building_database']['space'],
+                                     None if energy is None else energy['space'])
+    spatial_water = demand.finishing(hourly_water, mapped_population, parameters['building_database']['water'],
+                                     None if energy is None else energy['water'])
+
+    # COP (see section 5 of the processing notebook)
+    spatial_cop = cop.spatial_cop(cop.source_temperature(temperature),
+                                  cop.sink_temperature(temperature),
+                                  parameters['cop_parameters'],
+                                  resolution)
+
+    return spatial_space, spatial_water, spatial_cop
+
+
+def hourly(reference_temperature, wind, parameters, resolution='60min'):
+
+    adjusted_temperature = demand.adjust_temperature(reference_temperature, parameters['heating_thresholds'])
+
+    daily_heat = demand.daily_heat(adjusted_temperature, wind, parameters['daily_parameters'])
+    daily_water = demand.daily_water(adjusted_temperature, wind, parameters['daily_parameters'])
+
+    hourly_heat = demand.hourly_heat(daily_heat, reference_temperature, parameters['hourly_parameters'], resolution)
+    hourly_water = demand.hourly_water(daily_water, reference_temperature, parameters['hourly_parameters'], resolution)
+
+    return (hourly_heat - hourly_water).clip(lower=0), hourly_water
+
+
+def national(spatial_space, spatial_water, spatial_cop, resolution='60min'):
+
+    return (demand.combine(spatial_space, spatial_water, resolution),
+            cop.finishing(spatial_cop, spatial_space, spatial_water, resolution=resolution))
+
+
+def error_report(temperature, reference_temperature, wind, mapped_population, parameters, resolution='60min'):
+
+    # The country-mean approximation is compared to the grid-cell method on the same inputs
+    results = {}
+    for country_mean in [False, True]:
+        start = time.time()
+        final_heat, final_cop = national(*spatial(temperature, reference_temperature, wind, mapped_population,
+                                                  parameters, resolution, country_mean), resolution)
+        results[country_mean] = pd.concat([final_heat, final_cop], axis=1)
+        print('{} method: {:.1f} seconds'.format('Country-mean' if country_mean else 'Grid-cell', time.time() - start))
+
+    exact = results[False].astype('float64')
+    approximate = results[True][exact.columns].astype('float64')
+    error = approximate - exact
+
+    # Errors are expressed relative to the mean of the grid-cell results
+    mean = exact.mean()
+    return pd.DataFrame({
+        'mean_error': error.mean() / mean,
+        'mean_absolute_error': error.abs().mean() / mean,
+        'root_mean_squared_error': np.sqrt((error ** 2).mean()) / mean,
+        'peak_error': approximate.max() / exact.max() - 1,
+        'correlation': approximate.corrwith(exact)
+    })
+
+
+def chunk(input_path, year_start, year_end, mapped_population, wind, parameters, resolution='60min',
+          country_mean=False, energy=None, trail_days=0):
+
+    # The reference temperature requires the three days preceding the chunk
+    # The chunks are already processed in parallel, so that the files of a chunk are read one after the other
+    temperature = preprocess.temperature(input_path, year_start, year_end, mapped_population, lead_days=3,
+                                         processes=1, trail_days=trail_days)
+    reference_temperature = demand.reference_temperature(temperature['air']).loc[str(year_start):]
+    temperature = temperature.loc[str(year_start):]
+
+    return national(*spatial(temperature, reference_temperature, wind, mapped_population, parameters, resolution,
+                             country_mean, energy), resolution)
+
+
+def chunk_energy(input_path, year_start, year_end, mapped_population, wind, parameters, resolution='60min',
+                 country_mean=False):
+
+    # Yearly energy of the heat demand of a chunk as in chunk, but without COP and aggregation
+    temperature = preprocess.temperature(input_path, year_start, year_end, mapped_population, lead_days=3,
+                                         processes=1)
+    reference_temperature = demand.reference_temperature(temperature['air']).loc[str(year_start):]
+
+    if country_mean:
+        reference_temperature = preprocess.country_mean(reference_temperature, mapped_population)
+        wind = preprocess.country_mean(wind, mapped_population)
+        mapped_population = preprocess.country_population(mapped_population)
+
+    hourly_space, hourly_water = hourly(reference_temperature, wind, parameters, resolution)
+
+    return {'space': demand.yearly_energy(hourly_space, mapped_population),
+            'water': demand.yearly_energy(hourly_water, mapped_population)}
+
+
+def chunked(input_path, output_path, home_path, year_start, year_end, mapped_population, wind,
+            years_per_chunk=1, processes=1, resolution='60min', country_mean=False):
+
+    # The years are processed in chunks, which are computed in parallel and written to disk one after the other
+    # At most one chunk per process is held in memory at a time
+    if not divides_years(resolution):
+        raise ValueError('The time steps of resolution {} extend over the turn of the year.'.format(resolution))
+    chunks = [(start, min(start + years_per_chunk - 1, year_end))
+              for start in range(year_start, year_end + 1, years_per_chunk)]
+    all_parameters = parameters(input_path)
+
+    with ProcessPoolExecutor(processes) as executor:
+
+        # The heat profiles of all chunks are scaled to 1 TWh/a on average over all years as in a full run, for which
+        # the energy of each year is calculated in a first pass over the chunks
+        energy = list(executor.map(chunk_energy, repeat(input_path), *zip(*chunks), repeat(mapped_population),
+                                   repeat(wind), repeat(all_parameters), repeat(resolution), repeat(country_mean)))
+        energy = {attribute: pd.concat([part[attribute] for part in energy])
+                  for attribute in ['space', 'water']}
+
+        # Each chunk except the last one is computed for the first day of the following year in addition, so that
+        # the hours up to the turn of the year in UTC are complete for all countries
+        def submit(i):
+            return executor.submit(chunk, input_path, *chunks[i], mapped_population, wind, all_parameters, resolution,
+                                   country_mean, energy, 1 if i < len(chunks) - 1 else 0)
+
+        futures = deque(submit(i) for i in range(min(processes, len(chunks))))
+
+        for i, (start, end) in enumerate(chunks):
+
+            final_heat, final_cop = futures.popleft().result()
+            if i + processes < len(chunks):
+                futures.append(submit(i + processes))
+
+            # Chunks are cut at the turn of the year in UTC
+            df = pd.concat([final_heat, final_cop], axis=1)
+            if i > 0:
+                df = df.loc[df.index >= pd.Timestamp(year=start, month=1, day=1, tz='utc'), ]
+            if i < len(chunks) - 1:
+                df = df.loc[df.index < pd.Timestamp(year=end + 1, month=1, day=1, tz='utc'), ]
+
+            shaped_dfs = write.shaping(df[final_heat.columns], df[final_cop.columns])
+            write.to_sql(shaped_dfs, output_path, home_path, if_exists='replace' if i == 0 else 'append')
+            write.to_csv(shaped_dfs, output_path, mode='w' if i == 0 else 'a')
+
+            print('{}-{} written to disk.'.format(start, end))
@@ -1,43 +1,97 @@
 
 import os
+import json
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-from shapely.geometry import Point
+from itertools import repeat
+from concurrent.futures import ProcessPoolExecutor
 
 import scripts.read as read
-from scripts.misc import upsample_df
+import scripts.interim as interim
+import scripts.demand as demand
+from scripts.misc import upsample_df, checksum
 
 
-def map_population(input_path, countries, interim_path, plot=True):
+def weather_grid(input_path, interim_path):
 
-    population = None
-    weather_grid = None
-    mapped_population = {}
+    # The coordinates of the weather grid are cached by the checksum of the wind file
+    file = os.path.join(input_path, 'weather', 'ERA_wind.nc')
+    cache = os.path.join(interim_path, 'weather_grid_{}.npz'.format(checksum(file, interim_path)))
 
-    for country in countries:
+    if not os.path.isfile(cache):
+        latitude, longitude = read.weather_grid(input_path, 'ERA_wind.nc')
+        np.savez(cache, latitude=latitude, longitude=longitude)
 
-        file = os.path.join(interim_path, 'population_{}'.format(country))
+    with np.load(cache) as grid:
+        return grid['latitude'], grid['longitude']
 
-        if not os.path.isfile(file):
 
-            if population is None:
+def population_table(input_path, interim_path):
+
+    # The parsed and re-projected population data is cached by the checksum of the GEOSTAT file
+    file = read.population_file(input_path)
+    cache = os.path.join(interim_path, 'population_table_{}.npz'.format(checksum(file, interim_path)))
+
+    if not os.path.isfile(cache):
+
+        # Align coordinate reference systems
+        gdf = read.population(input_path).to_crs({'init': 'epsg:4326'})
+
+        np.savez(cache,
+                 latitude=gdf.geometry.y.values,
+                 longitude=gdf.geometry.x.values,
+                 population=gdf['TOT_P'].values,
+                 country=gdf['CNTR_CODE'].values.astype(str))
+
+    with np.load(cache) as table:
+        return pd.DataFrame({column: table[column] for column in ['latitude', 'longitude', 'population', 'country']})
+
 
-                population = read.population(input_path)
-                weather_data = read.wind(input_path)  # For the weather grid
+def grid_cells(df, grid, size=.75):
 
-                # Make GeoDataFrame from the weather data coordinates
-                weather_grid = gpd.GeoDataFrame(index=weather_data.columns)
-                weather_grid['geometry'] = weather_grid.index.map(lambda i: Point(reversed(i)))
+    # Each point is assigned to all weather grid cells, i.e., squares of the given size around the grid points,
+    # in which it lies (as in a spatial join with the cell polygons, cells overlap if the grid is finer)
+    axes = {}
+    for axis, coordinates in zip(['latitude', 'longitude'], grid):
+        step = coordinates[1] - coordinates[0]
+        position = (df[axis].values - coordinates[0]) / step
+        radius = size / 2 / abs(step)
+        axes[axis] = (coordinates, position, radius)
 
-                # Set coordinate reference system to 'latitude/longitude'
-                weather_grid.crs = {'init': 'epsg:4326'}
+    cells = []
+    for i in range(-int(np.ceil(axes['latitude'][2])), int(np.ceil(axes['latitude'][2])) + 1):
+        for j in range(-int(np.ceil(axes['longitude'][2])), int(np.ceil(axes['longitude'][2])) + 1):
 
-                # Make polygons around the weather points
-                weather_grid['geometry'] = weather_grid.geometry.apply(lambda point: point.buffer(.75 / 2, cap_style=3))
+            indices = {}
+            within = np.ones(len(df), dtype=bool)
+            for axis, offset in zip(['latitude', 'longitude'], [i, j]):
+                coordinates, position, radius = axes[axis]
+                indices[axis] = np.round(position).astype(int) + offset
+                within &= (np.abs(position - indices[axis]) < radius) \
+                    & (indices[axis] >= 0) & (indices[axis] < len(coordinates))
 
-                # Make list from MultiIndex (this is necessary for the spatial join)
-                weather_grid.index = weather_grid.index.tolist()
+            cells.append(pd.DataFrame({
+                axis: axes[axis][0][indices[axis][within]] for axis in ['latitude', 'longitude']
+            }).assign(population=df['population'].values[within]))
 
+    return pd.concat(cells).groupby(['latitude', 'longitude'])['population'].sum()
+
+
+def map_population(input_path, countries, interim_path, plot=True):
+
+    population = None
+    grid = None
+    mapped_population = {}
+
+    for country in countries:
+
+        file = os.path.join(interim_path, 'population_{}'.format(country))
+
+        if not interim.exists(file):
+
+            if population is None:
+                population = population_table(input_path, interim_path)
+                grid = weather_grid(input_path, interim_path)
 
             # For Luxembourg, a single weather grid point is manually added for lack of population geodata
             if country == 'LU':
@@ -47,27 +101,21 @@ def map_population(input_path, countries, interim_path, plot=True):
 
                 # Filter population data by country to cut processing time
                 if country == 'GB':
-                    gdf = population[population['CNTR_CODE'] == 'UK'].copy()
+                    df = population[population['country'] == 'UK']
                 elif country == 'GR':
-                    gdf = population[population['CNTR_CODE'] == 'EL'].copy()
+                    df = population[population['country'] == 'EL']
                 else:
-                    gdf = population[population['CNTR_CODE'] == country].copy()
-
-                # Align coordinate reference systems
-                gdf = gdf.to_crs({'init': 'epsg:4326'})
-
-                # Spatial join
-                gdf = gpd.sjoin(gdf, weather_grid, how="left", op='within')
+                    df = population[population['country'] == country]
 
-                # Sum up population
-                s = gdf.groupby('index_right')['TOT_P'].sum()
+                # Sum up population per weather grid cell
+                s = grid_cells(df, grid)
 
             # Write results to interim path
-            s.to_pickle(file)
+            interim.save(s, file)
 
         else:
 
-            s = pd.read_pickle(file)
+            s = interim.load(file, mmap=False)
             print('{} already exists and is read from disk.'.format(file))
 
         mapped_population[country] = s
@@ -75,24 +123,56 @@ def map_population(input_path, countries, interim_path, plot=True):
     if plot:
         print('Plot of the re-mapped population data of {} (first selected country) '
               'for visual inspection:'.format(countries[0]))
-        gdf = gpd.GeoDataFrame(mapped_population[countries[0]], columns=['TOT_P'])
-        gdf['geometry'] = gdf.index.map(lambda i: Point(reversed(i)))
-        gdf.plot(column='TOT_P')
+        plot_map(mapped_population[countries[0]], 'TOT_P')
 
     return mapped_population
 
 
-def wind(input_path, mapped_population, plot=True):
+def plot_map(s, column):
+
+    # Geodata packages are only imported for plotting
+    import geopandas as gpd
+    from shapely.geometry import Point
+
+    gdf = gpd.GeoDataFrame(s, columns=[column])
+    gdf['geometry'] = gdf.index.map(lambda i: Point(reversed(i)))
+    gdf.plot(column=column)
+
+
+def wind(input_path, mapped_population, plot=True, interim_path=None):
+
+    cells = pd.concat(list(mapped_population.values())).index.unique()
+
+    # The windiness map is cached by the checksum of the wind file
+    s = None
+    if interim_path is not None:
+        file = os.path.join(interim_path, 'wind_{}'.format(
+            checksum(os.path.join(input_path, 'weather', 'ERA_wind.nc'), interim_path)
+        ))
+        if interim.exists(file):
+            cached = interim.load(file, mmap=False)
+            if cells.isin(cached.index).all():
+                s = cached['wind']
+            else:
+                cells = cells.union(cached.index)
+
+    if s is None:
+
+        # Temporal average, streamed from the section of the weather grid that contains the populated cells
+        latitude, longitude = weather_grid(input_path, interim_path) if interim_path is not None \
+            else read.weather_grid(input_path, 'ERA_wind.nc')
+        rows = np.flatnonzero(np.isin(latitude, cells.get_level_values('latitude')))
+        columns = np.flatnonzero(np.isin(longitude, cells.get_level_values('longitude')))
+        s = read.weather_mean(input_path, 'ERA_wind.nc', 'si10',
+                              slice(rows.min(), rows.max() + 1), slice(columns.min(), columns.max() + 1))
 
-    df = read.wind(input_path)
+        if interim_path is not None:
+            # Both columns are stored as floats, since the interim format holds a single data type
+            interim.save(pd.DataFrame({'wind': s, 'windy': demand.windy(s).astype(s.dtype)}), file)
 
-    # Temporal average
-    s = df.mean(0)
     if plot:
         print('Plot of the wind averages for visual inspection:')
-        gdf = gpd.GeoDataFrame(s, columns=['wind'])
-        gdf['geometry'] = gdf.index.map(lambda i: Point(reversed(i)))
-        gdf.plot(column='wind')
+        plot_map(s, 'wind')
 
     # Wind data is filtered by country
     return pd.concat(
@@ -101,31 +181,172 @@ def wind(input_path, mapped_population, plot=True):
     ).apply(pd.to_numeric, downcast='float')
 
 
-def temperature(input_path, year_start, year_end, mapped_population):
+def filter_countries(df, mapped_population):
+
+    # Weather data is filtered by country
+    return pd.concat(
+        [df[population.index] for population in mapped_population.values()],
+        keys=mapped_population.keys(), axis=1, names=['country', 'latitude', 'longitude']
+    ).apply(pd.to_numeric, downcast='float')
+
+
+def temperature(input_path, year_start, year_end, mapped_population, lead_days=0, processes=4, trail_days=0):
 
     parameters = {
         'air': 't2m',
         'soil': 'stl1'
     }
 
-    ts_parameters = []
-    for parameter in parameters.values():
-
-        ts_years = []
-        for year in list(range(year_start, year_end + 1)):
-            ts = read.temperature(input_path, year, year, parameter)
-            ts_years.append(ts)
-
-        df_years = pd.concat(ts_years, axis=0)
+    # Optionally, the last days of the preceding year are prepended (e.g., for the reference temperature)
+    years = [(year, slice(None)) for year in range(year_start, year_end + 1)]
+    if lead_days > 0 and os.path.isfile(os.path.join(
+            input_path, 'weather', 'ERA_temperature_2m_temperature_{}.nc'.format(year_start - 1))):
+        years.insert(0, (year_start - 1, slice(-24 * lead_days, None)))
+
+    # Likewise, the first days of the following year are appended (e.g., for chunks, see pipeline.chunked)
+    if trail_days > 0 and os.path.isfile(os.path.join(
+            input_path, 'weather', 'ERA_temperature_2m_temperature_{}.nc'.format(year_end + 1))):
+        years.append((year_end + 1, slice(None, 24 * trail_days)))
+
+    files = [(parameter, read.temperature_file(year, variable_name), variable_name, time_slice)
+             for parameter, variable_name in parameters.items() for year, time_slice in years]
+
+    # Weather data is filtered by country
+    cells = pd.concat(list(mapped_population.values()), keys=mapped_population.keys(),
+                      names=['country', 'latitude', 'longitude']).index
+    columns = pd.MultiIndex.from_tuples(
+        [(parameter,) + cell for parameter in parameters.keys() for cell in cells],
+        names=['parameter', 'country', 'latitude', 'longitude']
+    )
+
+    # The files are read in parallel processes (the netCDF library is not thread-safe)
+    # and their values are written into the preallocated output array
+    executor = ProcessPoolExecutor(processes) if processes > 1 else None
+    map_files = executor.map if executor is not None else map
+
+    # The time axes are read first to allocate the output and to locate each file in it
+    times = list(map_files(read.weather_time, repeat(input_path), [file[1] for file in files],
+                           [file[3] for file in files]))
+    index = times[0].append(times[1:]).unique().sort_values()
+    values = np.full((len(index), len(columns)), np.nan, dtype='float32')
+
+    cell_coordinates = (cells.get_level_values('latitude').values, cells.get_level_values('longitude').values)
+    file_values = map_files(read.weather_cells, repeat(input_path), [file[1] for file in files],
+                            [file[2] for file in files], repeat(cell_coordinates), [file[3] for file in files])
+
+    for (parameter, _, _, _), time, file_value in zip(files, times, file_values):
+        position = list(parameters.keys()).index(parameter) * len(cells)
+        values[index.get_indexer(time), position:position + len(cells)] = file_value
+
+    if executor is not None:
+        executor.shutdown()
+
+    return pd.DataFrame(values, index=index, columns=columns, copy=False)
+
+
+def country_population(mapped_population):
+
+    # In the country-mean approximation, each country is represented by its most populated cell
+    return {
+        country: pd.Series([population.sum()], index=pd.MultiIndex.from_tuples(
+            [population.idxmax()], names=['latitude', 'longitude']
+        ))
+        for country, population in mapped_population.items()
+    }
 
-        # Temperature data is filtered by country
-        df_countries = pd.concat(
-            [df_years[population.index] for population in mapped_population.values()],
-            keys=mapped_population.keys(), axis=1, names=['country', 'latitude', 'longitude']
-        ).apply(pd.to_numeric, downcast='float')
 
-        ts_parameters.append(df_countries)
+def country_mean(df, mapped_population):
+
+    # Population-weighted average of the weather data (Series or DataFrame) per country,
+    # labelled with the most populated cell of each country
+    frame = df.to_frame().T if isinstance(df, pd.Series) else df
+
+    population = pd.concat(mapped_population.values(), keys=mapped_population.keys(),
+                           names=['country', 'latitude', 'longitude'])
+    cells = pd.MultiIndex.from_arrays(
+        [frame.columns.get_level_values(level) for level in ['country', 'latitude', 'longitude']]
+    )
+    weights = population.reindex(cells).to_numpy()
+
+    groups = [level for level in frame.columns.names if level not in ['latitude', 'longitude']]
+    means = (frame * weights).groupby(level=groups, axis=1).sum() / \
+        pd.Series(weights, index=frame.columns).groupby(level=groups).sum()
+
+    # The latitude and longitude of the representative cell are appended to the column labels
+    representative = {country: population.idxmax() for country, population in mapped_population.items()}
+    countries = means.columns.get_level_values('country')
+    means.columns = pd.MultiIndex.from_arrays(
+        [means.columns.get_level_values(level) for level in groups] +
+        [[representative[country][0] for country in countries], [representative[country][1] for country in countries]],
+        names=groups + ['latitude', 'longitude']
+    )
+    means = means.astype(np.result_type(*frame.dtypes))
+
+    return means.iloc[0].rename(df.name) if isinstance(df, pd.Series) else means
+
+
+def jrc_idees(input_path, workbook_path, interim_path, countries, year_start=2008, year_end=2015, processes=4):
+
+    # The annual useful energy demand for space and water heating in residential and tertiary buildings is taken from
+    # the JRC-IDEES workbooks, converted from ktoe to TWh, and written to input/JRC_IDEES (see read.building_database)
+    # The checksums of the workbooks and the manifest of the last build are kept in the interim directory, so that
+    # they are not copied with the input data into the data package
+    output_path = os.path.join(input_path, 'JRC_IDEES')
+    os.makedirs(output_path, exist_ok=True)
+    os.makedirs(interim_path, exist_ok=True)
+
+    sectors = ['Residential', 'Tertiary']
+    applications = ['space', 'water']
+    years = [str(year) for year in range(year_start, year_end + 1)]
+
+    # In JRC-IDEES, GB is named UK and GR is named EL
+    codes = {'GB': 'UK', 'GR': 'EL'}
+    files = {
+        (sector, country): os.path.join(workbook_path, 'JRC-IDEES-2015_{}_{}.xlsx'.format(
+            sector, codes.get(country, country)
+        ))
+        for sector in sectors for country in countries
+    }
+    csv_files = {
+        (sector, application): os.path.join(output_path, '{}_{}.csv'.format(sector, application))
+        for sector in sectors for application in applications
+    }
 
-    return pd.concat(
-        ts_parameters, keys=parameters.keys(), names=['parameter', 'country', 'latitude', 'longitude'], axis=1
-    )
\ No newline at end of file
+    # Workbooks that are unchanged since the last build are not parsed again, but taken from the CSV files
+    checksums = {os.path.basename(file): checksum(file, interim_path) for file in files.values()}
+    manifest_file = os.path.join(interim_path, 'jrc_idees_manifest.json')
+    manifest = {}
+    previous = {}
+    if os.path.isfile(manifest_file) and all(os.path.isfile(file) for file in csv_files.values()):
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+        previous = {key: pd.read_csv(file, decimal=',', index_col=0) for key, file in csv_files.items()}
+
+    def unchanged(sector, country):
+        return manifest.get('years') == years \
+            and manifest.get('workbooks', {}).get(os.path.basename(files[(sector, country)])) \
+            == checksums[os.path.basename(files[(sector, country)])] \
+            and all(country in previous[(sector, application)].index for application in applications)
+
+    changed = [key for key in files if not unchanged(*key)]
+    if not changed:
+        print('JRC-IDEES workbooks are unchanged.')
+        return
+
+    # Workbooks are parsed in parallel processes
+    with ProcessPoolExecutor(processes) as executor:
+        parsed = dict(zip(changed, executor.map(read.jrc_idees,
+                                                [files[key] for key in changed], [key[0] for key in changed])))
+
+    for (sector, application), file in csv_files.items():
+        pd.DataFrame(
+            [parsed[(sector, country)][application][years] * 1.163e-2 if (sector, country) in parsed
+             else previous[(sector, application)].loc[country, years]
+             for country in countries],
+            index=countries
+        ).to_csv(file, decimal=',')
+
+    with open(manifest_file, 'w') as f:
+        json.dump({'years': years, 'workbooks': checksums}, f, indent=1)
+
+    print('{} of {} JRC-IDEES workbooks parsed.'.format(len(changed), len(files)))
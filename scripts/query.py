@@ -0,0 +1,185 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import scripts.interim as interim
+import scripts.write as write
+
+
+# Built outputs are queried from a columnar copy of the multiindex CSV, which is memory-mapped, so that only the
+# selected columns and rows are read from disk. Recent query results are kept in a least-recently-used cache.
+
+_stores = {}
+_slices = OrderedDict()
+_lock = threading.Lock()
+
+
+def build(output_path, block_size=8760):
+
+    # The columnar copy is created once from the multiindex CSV (see write.to_csv), which is read in blocks of rows.
+    # The header and the UTC timestamps are read first, so that the store can be allocated in its final size.
+    file = os.path.join(output_path, 'when2heat_multiindex.csv')
+    columns = pd.read_csv(file, header=[0, 1, 2, 3], index_col=[0, 1], nrows=0).columns
+    index = pd.DatetimeIndex(pd.to_datetime(
+        pd.concat(pd.read_csv(file, header=None, skiprows=5, usecols=[0], chunksize=block_size * 10)).iloc[:, 0],
+        utc=True
+    ), name='utc_timestamp')
+
+    path = os.path.join(output_path, 'when2heat_store')
+    _stores.pop(os.path.realpath(path), None)
+    values = interim.allocate(path, index, columns)
+
+    start = 0
+    for block in pd.read_csv(file, header=None, skiprows=5, index_col=[0, 1], chunksize=block_size):
+        values[start:start + len(block)] = block.to_numpy(dtype='float64')
+        start += len(block)
+    values.flush()
+
+    return path
+
+
+def store(path):
+
+    key = os.path.realpath(path)
+    if key not in _stores:
+        _stores[key] = interim.load(path, mmap=True)
+
+    return _stores[key]
+
+
+def select(path, countries=None, variables=None, attributes=None, start=None, end=None, resolution=None,
+           cache_size=32):
+
+    # Queries are given by lists of countries, variables and attributes (all if None), the period from start
+    # (inclusive) to end (exclusive) in UTC, and optionally a coarser resolution, e.g., 'D' or 'M'
+    key = (os.path.realpath(path), *[tuple(np.atleast_1d(x)) if x is not None else None
+                                     for x in [countries, variables, attributes]], start, end, resolution)
+
+    with _lock:
+        if key in _slices:
+            _slices.move_to_end(key)
+            return _slices[key].copy()
+
+    df = store(path)
+
+    # Column pruning
+    selection = {level: values for level, values in zip(['country', 'variable', 'attribute'],
+                                                         [countries, variables, attributes]) if values is not None}
+    columns = np.flatnonzero(interim.select(df.columns, selection))
+
+    # Row slicing by binary search on the UTC index
+    timestamps = df.index.asi8
+    rows = slice(
+        np.searchsorted(timestamps, timestamp(start).value) if start is not None else 0,
+        np.searchsorted(timestamps, timestamp(end).value) if end is not None else len(timestamps)
+    )
+    result = df.iloc[rows, columns].copy()
+
+    if resolution is not None:
+        # The COP is weighted with the heat profiles of its country, which are read even if they are not selected
+        profiles = df.iloc[rows, np.flatnonzero(interim.select(df.columns, {
+            'country': result.columns.get_level_values('country').unique(), 'variable': 'heat_profile'
+        }))]
+        result = aggregate(result, resolution, profiles)
+
+    with _lock:
+        _slices[key] = result
+        while len(_slices) > cache_size:
+            _slices.popitem(last=False)
+
+    return result.copy()
+
+
+def timestamp(value):
+
+    value = pd.Timestamp(value)
+
+    return value.tz_localize('utc') if value.tz is None else value.tz_convert('utc')
+
+
+def aggregate(df, resolution, profiles):
+
+    # Heat demand and profiles are averaged, while the COP is aggregated as the ratio of the heat to the power over
+    # each time step as in cop.finishing. The heat of floor and radiator heating is given by the sum of the space
+    # heating profiles of the country, and that of water heating by the sum of its water heating profiles. In time
+    # steps without heat, the COP is the unweighted harmonic mean.
+    cop = df.columns.get_level_values('variable') == 'COP'
+    sinks = {'floor': 'space', 'radiator': 'space', 'water': 'water'}
+
+    countries = profiles.columns.get_level_values('country')
+    attributes = profiles.columns.get_level_values('attribute')
+    heat = pd.DataFrame(
+        np.column_stack([
+            profiles.loc[:, (countries == country) & attributes.str.startswith(sinks[attribute.split('_')[1]] + '_')]
+            .sum(axis=1).to_numpy(dtype='float64')
+            for country, _, attribute, _ in df.columns[cop]
+        ]) if cop.any() else np.empty((len(df), 0)),
+        index=df.index, columns=df.columns[cop]
+    )
+    power = (heat / df.loc[:, cop]).resample(resolution).sum()
+    heat = heat.resample(resolution).sum()
+    harmonic = 1 / (1 / df.loc[:, cop]).resample(resolution).mean()
+
+    return pd.concat(
+        [df.loc[:, ~cop].resample(resolution).mean(), (heat / power).where(heat > 0, harmonic)],
+        axis=1
+    )[df.columns]
+
+
+def serve(path, host='127.0.0.1', port=8000):
+
+    # Local HTTP server, e.g., http://127.0.0.1:8000/when2heat?country=DE,FR&variable=heat_demand
+    # &start=2015-01-01&end=2016-01-01&resolution=D&format=csv (or format=json)
+    # The available columns are listed at http://127.0.0.1:8000/columns
+    store(path)
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+
+            url = urlparse(self.path)
+            query = {name: values[0] for name, values in parse_qs(url.query).items()}
+            fmt = query.get('format', 'csv')
+
+            try:
+                if url.path == '/columns':
+                    df = store(path).columns.to_frame(index=False)
+                elif url.path == '/when2heat':
+                    df = select(
+                        path,
+                        *[query[name].split(',') if name in query else None
+                          for name in ['country', 'variable', 'attribute']],
+                        query.get('start'), query.get('end'), query.get('resolution')
+                    )
+                    df = df.set_axis(['_'.join(column[0:3]) for column in df.columns], axis=1)
+                    df.index = pd.Index(write.timestamps(df.index)['utc'], name='utc_timestamp')
+                else:
+                    self.send_error(404)
+                    return
+            except (ValueError, KeyError) as err:
+                self.send_error(400, str(err))
+                return
+
+            if fmt == 'json':
+                body = df.to_json(orient='split', date_format='iso').encode()
+                content_type = 'application/json'
+            else:
+                body = df.to_csv(float_format='%g').encode()
+                content_type = 'text/csv'
+
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    print('Serving {} at http://{}:{}'.format(path, host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -1,32 +1,26 @@
 
 import os
+import numpy as np
 import pandas as pd
-import geopandas as gpd
-import datetime as dt
-from netCDF4 import Dataset, num2date
-from shapely.geometry import Point
 
 
-def temperature(input_path, year_start, year_end, parameter):
+def temperature(input_path, year_start, year_end, parameter, time_slice=slice(None)):
 
+    return pd.concat(
+        [weather(input_path, temperature_file(year, parameter), parameter, time_slice)
+         for year in range(year_start, year_end + 1)],
+        axis=0
+    )
 
-    df_list = []
-    for year in range(year_start, year_end + 1):
-        if parameter == "t2m":
-            df_int = pd.concat(
-                [weather(input_path, 'ERA_temperature_{}_{}.nc'.format('2m_temperature', year), parameter)],
-                axis=0
-            )
 
-        if parameter == "stl1":
-            df_int = pd.concat(
-                [weather(input_path, 'ERA_temperature_{}_{}.nc'.format('soil_temperature_level_1', year), parameter)],
-                axis=0
-            )
-        df_list.append(df_int)
-    df = pd.concat(df_list, axis = 0)
+def temperature_file(year, parameter):
 
-    return df
+    names = {
+        't2m': '2m_temperature',
+        'stl1': 'soil_temperature_level_1'
+    }
+
+    return 'ERA_temperature_{}_{}.nc'.format(names[parameter], year)
 
 
 def wind(input_path):
@@ -34,21 +28,22 @@ def wind(input_path):
     return weather(input_path, 'ERA_wind.nc', 'si10')
 
 
-def weather(input_path, filename, variable_name):
+def weather(input_path, filename, variable_name, time_slice=slice(None)):
+
+    # netCDF4 is imported on first use to keep the import of this module light
+    from netCDF4 import Dataset
 
     file = os.path.join(input_path, 'weather', filename)
-    # Read the netCDF file
+    # Read the netCDF file (only the selected time steps are loaded into memory)
     nc = Dataset(file)
-    time = nc.variables['time'][:]
+    time = nc.variables['time'][time_slice]
     time_units = nc.variables['time'].units
     latitude = nc.variables['latitude'][:]
     longitude = nc.variables['longitude'][:]
-    variable = nc.variables[variable_name][:]
+    variable = nc.variables[variable_name][time_slice]
 
     # Transform to pd.DataFrame
-    index = pd.Index(num2date(time, time_units, only_use_python_datetimes=True), name='time')
-
-    index = index.map(lambda x: dt.datetime(x.year, x.month, x.day, x.hour, x.minute, x.second))
+    index = time_index(time, time_units)
 
     df = pd.DataFrame(data=variable.reshape(len(time), len(latitude) * len(longitude)),
                       index=index,
@@ -56,13 +51,96 @@ def weather(input_path, filename, variable_name):
 
     return df
 
+
+def time_index(time, time_units):
+
+    # Times are converted at once by datetime64 arithmetic (standard calendar), e.g., 'hours since 1900-01-01'
+    units = {'days': 'D', 'hours': 'h', 'minutes': 'm', 'seconds': 's'}
+    unit, origin = time_units.split(' since ')
+
+    return pd.DatetimeIndex(
+        pd.Timestamp(origin).tz_localize(None) + pd.to_timedelta(np.asarray(time, dtype='float64'), unit=units[unit]),
+        name='time'
+    )
+
+
+def weather_time(input_path, filename, time_slice=slice(None)):
+
+    from netCDF4 import Dataset
+
+    # Only the time axis is read from the netCDF file
+    with Dataset(os.path.join(input_path, 'weather', filename)) as nc:
+        return time_index(nc.variables['time'][time_slice], nc.variables['time'].units)
+
+
+def weather_cells(input_path, filename, variable_name, cells, time_slice=slice(None)):
+
+    from netCDF4 import Dataset
+
+    # Only the values of the given (latitude, longitude) cells are returned as array of time steps and cells,
+    # reading only the section of the grid that contains the cells
+    with Dataset(os.path.join(input_path, 'weather', filename)) as nc:
+
+        positions = []
+        for axis, coordinates in zip(['latitude', 'longitude'], cells):
+            grid = pd.Index(np.asarray(nc.variables[axis][:], dtype='float64'))
+            position = grid.get_indexer(np.asarray(coordinates, dtype='float64'))
+            if (position < 0).any():
+                raise KeyError('Cells not in the weather grid of {}'.format(filename))
+            positions.append(position)
+
+        (i, j) = positions
+        values = nc.variables[variable_name][time_slice, i.min():i.max() + 1, j.min():j.max() + 1]
+
+    return np.ma.filled(values.astype('float64'), np.nan)[:, i - i.min(), j - j.min()].astype('float32')
+
+
+def weather_mean(input_path, filename, variable_name, latitudes=slice(None), longitudes=slice(None),
+                 chunk_size=24):
+
+    from netCDF4 import Dataset
+
+    # The temporal mean is accumulated over chunks of time steps, optionally for a section of the grid only
+    nc = Dataset(os.path.join(input_path, 'weather', filename))
+    variable = nc.variables[variable_name]
+    latitude = np.asarray(nc.variables['latitude'][latitudes])
+    longitude = np.asarray(nc.variables['longitude'][longitudes])
+
+    total = np.zeros((len(latitude), len(longitude)))
+    count = np.zeros((len(latitude), len(longitude)))
+    for start in range(0, variable.shape[0], chunk_size):
+        values = np.ma.masked_invalid(variable[start:start + chunk_size, latitudes, longitudes])
+        total += values.sum(axis=0, dtype='float64').filled(0)
+        count += values.count(axis=0)
+
+    return pd.Series((total / count).ravel(),
+                     index=pd.MultiIndex.from_product([latitude, longitude], names=('latitude', 'longitude')))
+
+
+def weather_grid(input_path, filename):
+
+    from netCDF4 import Dataset
+
+    # Only the coordinates are read from the netCDF file
+    nc = Dataset(os.path.join(input_path, 'weather', filename))
+
+    return (np.asarray(nc.variables['latitude'][:], dtype='float64'),
+            np.asarray(nc.variables['longitude'][:], dtype='float64'))
+
+
+def population_file(input_path):
+
+    return os.path.join(input_path, 'population', 'Version 2_0_1', 'GEOSTAT_grid_POP_1K_2011_V2_0_1.csv')
+
+
 def population(input_path):
 
-    directory = 'population/Version 2_0_1/'
-    filename = 'GEOSTAT_grid_POP_1K_2011_V2_0_1.csv'
+    # Geodata packages are imported on first use to keep the import of this module light
+    import geopandas as gpd
+    from shapely.geometry import Point
 
     # Read population data
-    df = pd.read_csv(os.path.join(input_path, directory, filename),
+    df = pd.read_csv(population_file(input_path),
                      usecols=['GRD_ID', 'TOT_P', 'CNTR_CODE'],
                      index_col='GRD_ID')
 
@@ -78,6 +156,14 @@ def population(input_path):
     return gdf
 
 
+def regions(input_path, filename):
+
+    # Regions (e.g., NUTS-2/3) are assigned to weather grid cells in a CSV file with the columns country, latitude,
+    # longitude, region and, optionally, share (for cells that are split among several regions)
+    file = os.path.join(input_path, 'regions', filename)
+    return pd.read_csv(file, index_col=['country', 'latitude', 'longitude'])
+
+
 def daily_parameters(input_path):
 
     file = os.path.join(input_path, 'bgw_bdew', 'daily_demand.csv')
@@ -124,6 +210,38 @@ def building_database(input_path):
         for heat_type in ['space', 'water']
     }
 
+
+def jrc_idees(file, sector):
+
+    # openpyxl is imported on first use to keep the import of this module light
+    from openpyxl import load_workbook
+
+    # The sheet with the useful energy demand is parsed once in read-only mode for both space and water heating
+    labels = {
+        'space': 'Space heating',
+        'water': 'Water heating' if sector == 'Residential' else 'Hot water'
+    }
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook['RES_hh_tes' if sector == 'Residential' else 'SER_hh_tes'].iter_rows(values_only=True)
+
+        # Years in the header are numbers or strings
+        header = [str(int(x)) if isinstance(x, (int, float)) else x for x in next(rows)[1:]]
+
+        values = {}
+        for row in rows:
+            for application, label in labels.items():
+                if row[0] == label and application not in values:
+                    values[application] = pd.to_numeric(pd.Series(row[1:], index=header))
+            if len(values) == len(labels):
+                break
+    finally:
+        workbook.close()
+
+    return values
+
+
 def cop_parameters(input_path):
 
     file = os.path.join(input_path, 'cop', 'cop_parameters.csv')
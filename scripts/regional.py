@@ -0,0 +1,96 @@
+import os
+import numpy as np
+import pandas as pd
+
+import scripts.cop as cop
+import scripts.interim as interim
+from scripts.misc import group_df_by_multiple_column_levels
+
+
+def matrix(columns, regions):
+
+    # Sparse matrix in compressed row format, which maps the columns of a spatial DataFrame to regions while keeping
+    # all other column levels (e.g., unit and building type). Cells without region are dropped.
+    cells = ['country', 'latitude', 'longitude']
+    others = [level for level in columns.names if level not in cells]
+
+    table = regions.reset_index()
+    if 'share' not in table.columns:
+        table['share'] = 1.
+
+    merged = columns.to_frame(index=False).assign(column=np.arange(len(columns))).merge(table, on=cells)
+    codes, labels = pd.MultiIndex.from_frame(merged[['region'] + others]).factorize(sort=True)
+    order = np.argsort(codes, kind='stable')
+
+    return {
+        'indptr': np.concatenate([[0], np.cumsum(np.bincount(codes, minlength=len(labels)))]),
+        'indices': merged['column'].to_numpy()[order],
+        'data': merged['share'].to_numpy(dtype='float64')[order],
+        'labels': labels
+    }
+
+
+def aggregate(df, matrix):
+
+    # Missing values are skipped, but remain missing if all cells of a region are missing
+    values = df.to_numpy(dtype='float64')
+    missing = np.isnan(values)
+    values[missing] = 0
+
+    results = np.empty((len(df), len(matrix['labels'])))
+    for i in range(len(matrix['labels'])):
+        entries = slice(matrix['indptr'][i], matrix['indptr'][i + 1])
+        columns = matrix['indices'][entries]
+        results[:, i] = values[:, columns] @ matrix['data'][entries]
+        results[missing[:, columns].all(axis=1), i] = np.nan
+
+    return pd.DataFrame(results, index=df.index, columns=matrix['labels'])
+
+
+def regional(spatial_space, spatial_water, spatial_cop, regions, output_path, name='regions', correction=.85):
+
+    # Heat demand and COP are aggregated from the weather grid cells to the given regions (see read.regions)
+    # The results are written year by year with float32 values (see interim.save), e.g., to regional/regions_heat_2015
+
+    # As in cop.finishing, the COP is weighted with the normalized heat demand of each cell
+    spatial_cop = cop.to_utc(spatial_cop)
+    demand_cells = {
+        sink: group_df_by_multiple_column_levels(
+            df.loc[:, df.columns.get_level_values('unit') == 'MW/TWh'], ['country', 'latitude', 'longitude']
+        ).reindex(index=spatial_cop.index, columns=pd.MultiIndex.from_arrays(
+            [spatial_cop.columns.get_level_values(level) for level in ['country', 'latitude', 'longitude']]
+        )).to_numpy(dtype='float64')
+        for sink, df in [('space', spatial_space), ('water', spatial_water)]
+    }
+    water = (spatial_cop.columns.get_level_values('sink') == 'water')
+    heat = pd.DataFrame(np.where(water, demand_cells['water'], demand_cells['space']),
+                        index=spatial_cop.index, columns=spatial_cop.columns)
+    power = heat / spatial_cop
+    heat = heat.where(power.notna())
+
+    # The mappings are calculated once and applied to all years
+    matrices = {
+        'space': matrix(spatial_space.columns, regions),
+        'water': matrix(spatial_water.columns, regions),
+        'cop': matrix(spatial_cop.columns, regions)
+    }
+
+    os.makedirs(os.path.join(output_path, 'regional'), exist_ok=True)
+
+    for year in spatial_space.index.year.unique():
+
+        demand = pd.concat(
+            [aggregate(df.loc[df.index.year == year], matrices[attribute])
+             for attribute, df in [('space', spatial_space), ('water', spatial_water)]],
+            keys=['space', 'water'], axis=1, names=['attribute', 'region', 'unit', 'building_type']
+        )
+        interim.save(demand.astype('float32'),
+                     os.path.join(output_path, 'regional', '{}_heat_{}'.format(name, year)))
+
+        rows = spatial_cop.index.year == year
+        coefficients = aggregate(heat.loc[rows], matrices['cop']) / aggregate(power.loc[rows], matrices['cop'])
+        coefficients.columns.names = ['region', 'source', 'sink']
+        interim.save((coefficients * correction).astype('float32'),
+                     os.path.join(output_path, 'regional', '{}_cop_{}'.format(name, year)))
+
+        print('Regional data of {} written to disk.'.format(year))
@@ -0,0 +1,138 @@
+import os
+import pickle
+import hashlib
+import pandas as pd
+
+import scripts.preprocess as preprocess
+import scripts.demand as demand
+import scripts.cop as cop
+import scripts.write as write
+import scripts.pipeline as pipeline
+
+
+def sweep(scenarios, temperature, reference_temperature, wind, mapped_population, parameters, output_path,
+          resolution='60min', country_mean=False):
+
+    # Scenarios are given as a dictionary of names and dictionaries with the parameters that deviate from the
+    # default parameters (see pipeline.parameters), e.g., 'heating_thresholds', 'daily_parameters', 'cop_parameters'
+
+    # Optionally, all scenarios are computed with the country-mean approximation (see pipeline.spatial)
+    if country_mean:
+        temperature = preprocess.country_mean(temperature, mapped_population)
+        reference_temperature = preprocess.country_mean(reference_temperature, mapped_population)
+        wind = preprocess.country_mean(wind, mapped_population)
+        mapped_population = preprocess.country_population(mapped_population)
+
+    # Parameter-independent intermediates are calculated only once for all scenarios
+    source_temperature = cop.source_temperature(temperature)
+    sink_temperature = cop.sink_temperature(temperature)
+
+    all_parameters = {name: dict(parameters, **deviations) for name, deviations in scenarios.items()}
+
+    # The daily demand of all scenarios with the same daily parameters is calculated at once (see daily)
+    daily_demand = {}
+    for daily_key in unique([key(p, ['daily_parameters']) for p in all_parameters.values()]):
+        daily_demand.update(daily(reference_temperature, wind, {
+            key(p, ['heating_thresholds', 'daily_parameters']): p for p in all_parameters.values()
+            if key(p, ['daily_parameters']) == daily_key
+        }))
+
+    # Intermediates depending on a subset of the parameters are reused by subsequent scenarios with the same subset
+    factors = {}
+    spatial_demand = {}
+    spatial_cop = {}
+
+    for name, scenario_parameters in all_parameters.items():
+
+        # The hourly factors only depend on the hourly parameters, as the temperature classes are taken from the
+        # reference temperature before the adjustment to the heating thresholds (see pipeline.hourly)
+        factors_key = key(scenario_parameters, ['hourly_parameters'])
+        if factors_key not in factors:
+            factors.clear()
+            factors[factors_key] = hourly_factors(reference_temperature, scenario_parameters['hourly_parameters'],
+                                                  resolution)
+
+        demand_key = key(scenario_parameters, ['heating_thresholds', 'daily_parameters', 'hourly_parameters',
+                                               'building_database'])
+        if demand_key not in spatial_demand:
+            spatial_demand.clear()
+            spatial_demand[demand_key] = spatial(
+                *daily_demand[key(scenario_parameters, ['heating_thresholds', 'daily_parameters'])],
+                mapped_population, scenario_parameters, factors[factors_key], resolution
+            )
+        spatial_space, spatial_water = spatial_demand[demand_key]
+
+        cop_key = key(scenario_parameters, ['cop_parameters'])
+        if cop_key not in spatial_cop:
+            spatial_cop.clear()
+            spatial_cop[cop_key] = cop.spatial_cop(source_temperature, sink_temperature,
+                                                   scenario_parameters['cop_parameters'], resolution)
+
+        final_heat, final_cop = pipeline.national(spatial_space, spatial_water, spatial_cop[cop_key], resolution)
+
+        # Results are written to disk scenario by scenario
+        scenario_path = os.path.join(output_path, 'scenarios', name)
+        os.makedirs(scenario_path, exist_ok=True)
+        shaped_dfs = write.shaping(final_heat, final_cop)
+        write.to_csv({'multiindex': shaped_dfs['multiindex']}, scenario_path)
+
+        print('Scenario {} written to disk.'.format(name))
+
+
+def key(parameters, names):
+
+    # Parameter tables are identified by their content
+    return hashlib.md5(pickle.dumps([parameters[name] for name in names])).hexdigest()
+
+
+def unique(keys):
+
+    # Keys in the order of their first occurrence
+    return list(dict.fromkeys(keys))
+
+
+def daily(reference_temperature, wind, scenario_parameters):
+
+    # The adjusted temperatures of all heating thresholds are stacked along the days, so that the daily functions are
+    # applied once per location and building type for all scenarios (instead of once per scenario), given that all
+    # scenarios share the same daily parameters
+    adjusted_temperature = pd.concat(
+        [demand.adjust_temperature(reference_temperature, parameters['heating_thresholds'])
+         for parameters in scenario_parameters.values()],
+        ignore_index=True
+    )
+    daily_parameters = next(iter(scenario_parameters.values()))['daily_parameters']
+
+    daily_heat = demand.daily_heat(adjusted_temperature, wind, daily_parameters)
+    daily_water = demand.daily_water(adjusted_temperature, wind, daily_parameters)
+
+    # The days of each scenario are taken back from the stacked days
+    days = len(reference_temperature)
+    return {
+        scenario_key: tuple(df.iloc[i * days:(i + 1) * days].set_axis(reference_temperature.index)
+                            for df in [daily_heat, daily_water])
+        for i, scenario_key in enumerate(scenario_parameters.keys())
+    }
+
+
+def hourly_factors(reference_temperature, hourly_parameters, resolution):
+
+    buildings = ['SFH', 'MFH', 'COM']
+
+    return {
+        'heat': demand.hourly_factors(demand.heat_classes(reference_temperature), hourly_parameters, buildings,
+                                      resolution),
+        'water': demand.hourly_factors(demand.water_classes(reference_temperature), hourly_parameters, buildings,
+                                       resolution)
+    }
+
+
+def spatial(daily_heat, daily_water, mapped_population, parameters, factors, resolution):
+
+    # Heat demand as in pipeline.spatial, but with the daily demand and the hourly factors calculated beforehand
+    hourly_heat = demand.hourly(daily_heat, None, parameters['hourly_parameters'], resolution, factors['heat'])
+    hourly_water = demand.hourly(daily_water, None, parameters['hourly_parameters'], resolution, factors['water'])
+    hourly_space = (hourly_heat - hourly_water).clip(lower=0)
+
+    return (demand.finishing(hourly_space, mapped_population, parameters['building_database']['space']),
+            demand.finishing(hourly_water, mapped_population, parameters['building_database']['water']))
@@ -1,7 +1,68 @@
 
 import os
+import gzip
 import sqlite3
+import hashlib
+import numpy as np
 import pandas as pd
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+
+
+_timestamps = {}
+_digests = {}
+
+
+def join_strings(*arrays):
+
+    # Element-wise concatenation of arrays of strings, each filling its fixed width, through their character buffers
+    # The widths are given by the data types, so that empty arrays are joined as well
+    chars = np.concatenate([array.view('U1').reshape(len(array), array.dtype.itemsize // 4) for array in arrays],
+                           axis=1)
+
+    return chars.view('U{}'.format(chars.shape[1])).ravel()
+
+
+def format_timestamps(values):
+
+    # Dates and times of the day are formatted once for each distinct value and then joined
+    days = values.astype('datetime64[D]')
+    unique_days, day_inverse = np.unique(days, return_inverse=True)
+    unique_times, time_inverse = np.unique(values - days, return_inverse=True)
+
+    time_strings = np.array(['T{:02d}:{:02d}:{:02d}'.format(seconds // 3600, seconds // 60 % 60, seconds % 60)
+                             for seconds in (unique_times // np.timedelta64(1, 's')).tolist()], dtype='U9')
+
+    return join_strings(np.datetime_as_string(unique_days).astype('U10')[day_inverse], time_strings[time_inverse])
+
+
+def timestamps(index):
+
+    # Formatted timestamps are cached by index, so that they are shared by all shapes and writers
+    index = pd.DatetimeIndex(index)
+    key = hash(index.asi8.tobytes())
+
+    if key not in _timestamps:
+
+        if len(_timestamps) >= 8:
+            _timestamps.clear()
+
+        utc = index.tz_convert('utc').tz_localize(None).values
+        local = index.tz_convert('Europe/Brussels').tz_localize(None).values
+        local_strings = format_timestamps(local)
+
+        # UTC offsets are formatted once for each distinct offset (i.e., CET and CEST)
+        offsets, inverse = np.unique((local - utc) // np.timedelta64(1, 'm'), return_inverse=True)
+        offset_strings = np.array(['{}{:02d}{:02d}'.format('-' if offset < 0 else '+', *divmod(abs(offset), 60))
+                                   for offset in offsets.tolist()], dtype='U5')
+
+        _timestamps[key] = {
+            'utc': join_strings(format_timestamps(utc), np.full(len(utc), 'Z')),
+            'cet_cest': join_strings(local_strings, offset_strings[inverse]),
+            'cet_cest_naive': local_strings
+        }
+
+    return _timestamps[key]
 
 
 def shaping(demand, cop):
@@ -13,12 +74,9 @@ def shaping(demand, cop):
     df = df.sort_index(level=0, axis=1)
 
     # Timestamp
-    index = pd.DatetimeIndex(df.index)
-    df.index = pd.MultiIndex.from_tuples(zip(
-        index.strftime('%Y-%m-%dT%H:%M:%SZ'),
-        index.tz_convert('Europe/Brussels').strftime('%Y-%m-%dT%H:%M:%S%z')
-    ))
-    df.index.names = ['utc_timestamp', 'cet_cest_timestamp']
+    formatted = timestamps(df.index)
+    df.index = pd.MultiIndex.from_arrays([formatted['utc'], formatted['cet_cest']],
+                                         names=['utc_timestamp', 'cet_cest_timestamp'])
 
     # SingleIndex
     single = df.copy()
@@ -32,42 +90,177 @@ def shaping(demand, cop):
     stacked.columns = stacked.columns.droplevel(['unit'])
     stacked = stacked.transpose().stack(dropna=True).to_frame(name='data')
 
-    # Excel
-    df_excel = df.copy()
-    df_excel.index = pd.MultiIndex.from_tuples(zip(
-        index.strftime('%Y-%m-%dT%H:%M:%SZ'),
-        index.tz_convert('Europe/Brussels').strftime('%Y-%m-%dT%H:%M:%S')
-    ))
-
     return {
         'multiindex': df,
         'singleindex': single,
-        'stacked': stacked,
-        'excel': df_excel
+        'stacked': stacked
     }
 
 
-def to_sql(shaped_dfs, output_path, home_path):
+def to_sql(shaped_dfs, output_path, home_path, if_exists='replace'):
 
     os.chdir(output_path)
     table = 'when2heat'
     shaped_dfs['singleindex'].to_sql(table, sqlite3.connect('when2heat.sqlite'),
-                                     if_exists='replace', index_label='utc_timestamp')
+                                     if_exists=if_exists, index_label='utc_timestamp')
     os.chdir(home_path)
 
 
-def to_csv(shaped_dfs, output_path):
+def to_csv(shaped_dfs, output_path, mode='w', compression=None, processes=1, block_size=8760, level=6):
+
+    # With mode='a', rows are appended to existing files without repeating the header
+    # Blocks of rows are formatted in parallel processes (if processes > 1) and, with compression 'gzip' or 'zstd',
+    # compressed in threads as independent gzip members or zstd frames, so that the files can be decompressed with
+    # the standard tools. Size and MD5 checksum of each file are computed while writing and returned by file name.
+    header = mode == 'w'
+    executor = ProcessPoolExecutor(processes) if processes > 1 else None
+    threads = ThreadPoolExecutor(max(processes, 2)) if compression is not None else None
 
+    results = {}
     for shape, df in shaped_dfs.items():
 
-        if shape == 'excel':
-            file = os.path.join(output_path, 'when2heat.xlsx.csv')
-            df.to_csv(file, sep=';', decimal=',', float_format='%g')
+        if shape == 'singleindex':
+            name = 'when2heat.csv'
+            options = {'sep': ';', 'decimal': ',', 'float_format': '%g'}
+        else:
+            name = 'when2heat_{}.csv'.format(shape)
+            options = {'float_format': '%g'}
+        if compression is not None:
+            name += extensions[compression]
 
-        elif shape == 'singleindex':
-            file = os.path.join(output_path, 'when2heat.csv')
-            df.to_csv(file, sep=';', decimal=',', float_format='%g')
+        file = os.path.join(output_path, name)
+        digest = checksum(file, mode)
 
-        else:
-            file = os.path.join(output_path, 'when2heat_{}.csv'.format(shape))
-            df.to_csv(file, float_format='%g')
+        with open(file, mode + 'b') as f:
+            pending = deque()
+            for start in range(0, max(len(df), 1), block_size):
+                args = (df.iloc[start:start + block_size], header and start == 0, options)
+                block = executor.submit(to_csv_block, *args) if executor is not None else to_csv_block(*args)
+
+                # Formatting futures are queued themselves, so that the blocks are formatted in parallel
+                if compression is not None:
+                    block = threads.submit(encode, block, compression, level)
+                pending.append(block)
+
+                # At most two blocks per process are held in memory
+                while len(pending) > 2 * processes:
+                    write_block(f, digest, pending.popleft())
+            while pending:
+                write_block(f, digest, pending.popleft())
+
+        results[name] = {'bytes': digest['bytes'], 'hash': digest['md5'].hexdigest()}
+
+    for pool in [executor, threads]:
+        if pool is not None:
+            pool.shutdown()
+
+    return results
+
+
+extensions = {'gzip': '.gz', 'zstd': '.zst'}
+
+
+def to_csv_block(df, header, options):
+
+    return df.to_csv(header=header, **options).encode()
+
+
+def encode(block, compression, level):
+
+    return compress(block.result() if isinstance(block, Future) else block, compression, level)
+
+
+def compress(data, compression, level):
+
+    if compression == 'gzip':
+        return gzip.compress(data, compresslevel=level)
+
+    # zstandard is only imported if requested
+    import zstandard
+    return zstandard.ZstdCompressor(level=level).compress(data)
+
+
+def checksum(file, mode):
+
+    # Checksums are continued when appending to a file written before; otherwise, the existing content is read once
+    if mode == 'a' and file in _digests:
+        return _digests[file]
+
+    digest = {'md5': hashlib.md5(), 'bytes': 0}
+    if mode == 'a' and os.path.isfile(file):
+        with open(file, 'rb') as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b''):
+                digest['md5'].update(chunk)
+                digest['bytes'] += len(chunk)
+    _digests[file] = digest
+
+    return digest
+
+
+def write_block(f, digest, block):
+
+    data = block.result() if isinstance(block, Future) else block
+    f.write(data)
+    digest['md5'].update(data)
+    digest['bytes'] += len(data)
+
+
+def to_excel(shaped_dfs, output_path, max_rows=1048576, max_columns=16384, block_size=10000):
+
+    # openpyxl is imported on first use; its write-only mode streams rows to the workbook in constant memory
+    from openpyxl import Workbook
+
+    # The Excel file is written from the multiindex shape with timestamps in UTC and local time without offset
+    df = shaped_dfs['multiindex']
+    utc = df.index.get_level_values('utc_timestamp').values
+    local = df.index.get_level_values('cet_cest_timestamp').values.astype('U19')
+    header_rows = df.columns.nlevels + 1
+
+    # Sheets are split by years if there are too many rows and by countries if there are too many columns
+    years = utc.astype('U4')
+    row_groups = split(pd.Series(years).groupby(years, sort=False).size(), max_rows - header_rows)
+    countries = df.columns.get_level_values('country')
+    column_groups = split(pd.Series(countries).groupby(countries, sort=False).size(), max_columns - 2)
+
+    workbook = Workbook(write_only=True)
+    for row_group in row_groups:
+        rows = np.flatnonzero(np.isin(years, row_group))
+
+        for column_group in column_groups:
+            columns = np.flatnonzero(countries.isin(column_group))
+
+            title = '-'.join(sorted({row_group[0], row_group[-1]}))
+            if len(column_groups) > 1:
+                title += ' {}'.format('-'.join(sorted({column_group[0], column_group[-1]})))
+            sheet = workbook.create_sheet(title)
+
+            # Header rows with the column levels and their names
+            for level, name in enumerate(df.columns.names):
+                sheet.append([None, name] + df.columns[columns].get_level_values(level).tolist())
+            sheet.append(['utc_timestamp', 'cet_cest_timestamp'])
+
+            # Values are streamed in blocks of rows, with missing values as empty cells
+            # The detour via the shortest string representation avoids spurious digits of float32 values
+            for start in range(rows[0], rows[-1] + 1, block_size):
+                stop = min(start + block_size, rows[-1] + 1)
+                block = df.iloc[start:stop, columns].astype(str).to_numpy().astype('float64')
+                for timestamp, local_timestamp, values in zip(utc[start:stop], local[start:stop], block.tolist()):
+                    sheet.append([timestamp, local_timestamp] + [None if value != value else value
+                                                                  for value in values])
+
+    workbook.save(os.path.join(output_path, 'when2heat.xlsx'))
+
+
+def split(sizes, limit):
+
+    # Consecutive labels are grouped such that the sum of their sizes does not exceed the limit
+    groups = [[]]
+    total = 0
+    for label, size in sizes.items():
+        if total + size > limit and groups[-1]:
+            groups.append([])
+            total = 0
+        groups[-1].append(label)
+        total += size
+
+    return groups
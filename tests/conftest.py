@@ -0,0 +1,129 @@
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+
+root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root_path)
+
+import scripts.read as read
+import scripts.interim as interim
+
+
+# The checks run on the parameter tables in the input directory and on synthetic weather data, so that they need
+# neither the downloaded weather and population data nor the JRC-IDEES building database
+
+
+@pytest.fixture(scope='session')
+def input_path():
+
+    return os.path.join(root_path, 'input')
+
+
+@pytest.fixture(scope='session')
+def parameters(input_path):
+
+    # Building database with random energy per country and year
+    rng = np.random.default_rng(1)
+    building_database = {
+        heat_type: {
+            building_type: pd.DataFrame(rng.uniform(10, 50, (2, 8)), index=['DE', 'GB'],
+                                        columns=[str(year) for year in range(2008, 2016)])
+            for building_type in ['Residential', 'Tertiary']
+        } for heat_type in ['space', 'water']
+    }
+
+    return {
+        'heating_thresholds': read.heating_thresholds(input_path),
+        'daily_parameters': read.daily_parameters(input_path),
+        'hourly_parameters': read.hourly_parameters(input_path),
+        'building_database': building_database,
+        'cop_parameters': read.cop_parameters(input_path)
+    }
+
+
+def weather(start='2010-01-01', days=14, countries=('DE', 'GB'), seed=0):
+
+    # Hourly air and soil temperature in K in the layout of preprocess.temperature, wind and population of two grid
+    # cells per country in the layout of preprocess.wind and preprocess.map_population
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(start, periods=24 * days, freq='60min')
+    cells = [(50., 10.), (50.25, 10.)]
+    columns = pd.MultiIndex.from_tuples([(country, ) + cell for country in countries for cell in cells],
+                                        names=['country', 'latitude', 'longitude'])
+
+    hours = np.arange(len(index))
+    air = pd.DataFrame(
+        (278 + 3 * np.sin(2 * np.pi * hours / 24))[:, None] + rng.normal(0, 2, (len(index), len(columns))),
+        index=index, columns=columns
+    ).astype('float32')
+    temperature = pd.concat([air, air + 1], axis=1, keys=['air', 'soil'],
+                            names=['parameter', 'country', 'latitude', 'longitude'])
+
+    wind = pd.Series(rng.uniform(3, 6, len(columns)), index=columns).astype('float32')
+    mapped_population = {
+        country: pd.Series([100. + i, 200.], index=pd.MultiIndex.from_tuples(cells, names=['latitude', 'longitude']))
+        for i, country in enumerate(countries)
+    }
+
+    return temperature, wind, mapped_population
+
+
+def input_files(path, years, building_database, countries=('DE', 'GB'), seed=0):
+
+    # Input directory with the parameter tables of the repository, the building database and weather files with
+    # synthetic hourly temperature and monthly wind in the layout of ERA5, and an interim directory with the population
+    # of two grid cells per country as stored by preprocess.map_population
+    netCDF4 = pytest.importorskip('netCDF4')
+    rng = np.random.default_rng(seed)
+
+    input_path = os.path.join(path, 'input')
+    interim_path = os.path.join(path, 'interim')
+    shutil.copytree(os.path.join(root_path, 'input'), input_path)
+    os.makedirs(os.path.join(input_path, 'weather'))
+    os.makedirs(os.path.join(input_path, 'JRC_IDEES'))
+    os.makedirs(interim_path)
+
+    for heat_type, tables in building_database.items():
+        for building_type, df in tables.items():
+            df.to_csv(os.path.join(input_path, 'JRC_IDEES', '{}_{}.csv'.format(building_type, heat_type)),
+                      decimal=',')
+
+    latitudes = np.array([51.5, 50.25, 50.], dtype='float32')
+    longitudes = np.array([0., 10.], dtype='float32')
+    cells = {'DE': [(50., 10.), (50.25, 10.)], 'GB': [(51.5, 0.), (50.25, 0.)]}
+
+    def write(file, variable_name, times, values):
+        with netCDF4.Dataset(os.path.join(input_path, 'weather', file), 'w') as nc:
+            nc.createDimension('time', None)
+            nc.createDimension('latitude', len(latitudes))
+            nc.createDimension('longitude', len(longitudes))
+            nc.createVariable('latitude', 'f4', ('latitude', ))[:] = latitudes
+            nc.createVariable('longitude', 'f4', ('longitude', ))[:] = longitudes
+            time = nc.createVariable('time', 'i4', ('time', ))
+            time.units = 'hours since 1900-01-01 00:00:00.0'
+            time.calendar = 'gregorian'
+            time[:] = (times - pd.Timestamp('1900-01-01')) // pd.Timedelta('60min')
+            nc.createVariable(variable_name, 'f4', ('time', 'latitude', 'longitude'))[:] = values
+
+    for year in years:
+        times = pd.date_range(str(year), str(year + 1), freq='60min', closed='left')
+        hours = np.arange(len(times))[:, None, None]
+        air = 278 + 8 * np.cos(2 * np.pi * hours / len(times)) + 3 * np.sin(2 * np.pi * hours / 24) \
+            + rng.normal(0, 2, (len(times), len(latitudes), len(longitudes)))
+        write(read.temperature_file(year, 't2m'), 't2m', times, air)
+        write(read.temperature_file(year, 'stl1'), 'stl1', times, air + 1)
+
+    times = pd.date_range('1979-01-01', '1989-12-01', freq='MS')
+    write('ERA_wind.nc', 'si10', times, rng.uniform(3, 6, (len(times), len(latitudes), len(longitudes))))
+
+    mapped_population = {}
+    for i, country in enumerate(countries):
+        mapped_population[country] = pd.Series(
+            [100. + i, 200.], index=pd.MultiIndex.from_tuples(cells[country], names=['latitude', 'longitude'])
+        )
+        interim.save(mapped_population[country], os.path.join(interim_path, 'population_{}'.format(country)))
+
+    return input_path, interim_path, mapped_population
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+import scripts.batch as batch
+import scripts.pipeline as pipeline
+import scripts.preprocess as preprocess
+import scripts.write as write
+from conftest import input_files
+
+
+def test_local_workers(tmp_path, parameters):
+
+    # Tasks of one year each, where the building database ends with the first year
+    input_path, interim_path, mapped_population = input_files(str(tmp_path), [2014, 2015, 2016],
+                                                              parameters['building_database'])
+    queue_path = str(tmp_path / 'queue')
+    batch.submit(queue_path, input_path, interim_path, ['DE', 'GB'], 2015, 2016)
+    batch.local(queue_path, workers=2)
+    assert (batch.status(queue_path) == 'done').all()
+    merged = batch.merge(queue_path)['multiindex']
+
+    # Single run over both years
+    wind = preprocess.wind(input_path, mapped_population, plot=False, interim_path=interim_path)
+    final_heat, final_cop = pipeline.chunk(input_path, 2015, 2016, mapped_population, wind,
+                                           pipeline.parameters(input_path))
+    expected = write.shaping(final_heat, final_cop)['multiindex']
+
+    assert merged.index.equals(expected.index)
+    assert merged.columns.equals(expected.columns)
+
+    # Absolute values are missing in the year without building data as in the single run. The heat profiles, and the
+    # COP weighted with them, may differ by their rounding, since they are scaled to the energy of all years in merge.
+    variables = merged.columns.get_level_values('variable')
+    pd.testing.assert_frame_equal(merged.isna(), expected.isna())
+    assert merged.loc['2016-01-02':, variables == 'heat_demand'].isna().all().all()
+    pd.testing.assert_frame_equal(merged.loc[:, variables == 'heat_demand'],
+                                  expected.loc[:, variables == 'heat_demand'], check_dtype=False)
+    difference = (merged - expected).abs()
+    assert np.nanmax(difference.loc[:, variables == 'heat_profile'].to_numpy()) <= 1
+    assert np.nanmax(difference.loc[:, variables == 'COP'].to_numpy()) <= .01 + 1e-6
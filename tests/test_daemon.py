@@ -0,0 +1,85 @@
+import io
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import subprocess
+import urllib.request
+import numpy as np
+import pandas as pd
+
+import scripts.pipeline as pipeline
+import scripts.preprocess as preprocess
+from conftest import root_path, input_files
+
+
+def free_port():
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_compute_and_evict(tmp_path, parameters):
+
+    input_path, interim_path, mapped_population = input_files(str(tmp_path), [2014, 2015, 2016],
+                                                              parameters['building_database'], countries=('DE', ))
+    shared_path = str(tmp_path / 'shared')
+    os.makedirs(shared_path)
+
+    # The memory budget holds the temperature of one year of the two grid cells (about 140 kB), but not of two
+    url = 'http://127.0.0.1:{}'.format(free_port())
+    process = subprocess.Popen(
+        [sys.executable, '-c', 'import scripts.daemon as daemon; daemon.serve({!r}, {!r}, port={}, processes=2, '
+                               'memory=2e5, shared_path={!r})'.format(input_path, interim_path, url.split(':')[-1],
+                                                                      shared_path)],
+        cwd=root_path, stdout=subprocess.DEVNULL
+    )
+
+    def status():
+        with urllib.request.urlopen(url + '/status') as response:
+            return [(entry['countries'], entry['year']) for entry in json.load(response)]
+
+    def compute(year_start, year_end):
+        request = {'countries': ['DE'], 'year_start': year_start, 'year_end': year_end}
+        with urllib.request.urlopen(url + '/compute', json.dumps(request).encode()) as response:
+            return pd.read_csv(io.StringIO(response.read().decode()), index_col=0)
+
+    try:
+        for _ in range(600):
+            try:
+                status()
+                break
+            except OSError:
+                time.sleep(.1)
+
+        df = compute(2015, 2015)
+        assert status() == [(['DE'], 2015)]
+        assert len(os.listdir(shared_path)) == 1
+
+        # The year of the earlier request is evicted
+        compute(2016, 2016)
+        assert status() == [(['DE'], 2016)]
+        assert len(os.listdir(shared_path)) == 1
+
+        # Absolute values are missing in the year without building data
+        both_years = compute(2015, 2016)
+        absolute = both_years.loc[both_years.index >= '2016-01-01T12', both_years.columns.str.contains('heat_demand')]
+        assert absolute.isna().all().all()
+
+    finally:
+        process.send_signal(signal.SIGINT)
+        process.wait(timeout=60)
+
+    # The files of the datasets are removed at shutdown
+    assert os.listdir(shared_path) == []
+
+    # The results equal a run of the pipeline, apart from the six significant digits of the CSV
+    wind = preprocess.wind(input_path, mapped_population, plot=False, interim_path=interim_path)
+    expected = pd.concat(pipeline.chunk(input_path, 2015, 2015, mapped_population, wind,
+                                        pipeline.parameters(input_path)), axis=1)
+    assert list(df.columns) == ['_'.join(column[0:3]) for column in expected.columns]
+    assert (pd.to_datetime(df.index) == expected.index).all()
+    assert np.allclose(df.to_numpy(), expected.to_numpy(dtype='float64'), rtol=1e-5, equal_nan=True)
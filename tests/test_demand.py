@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+
+import scripts.demand as demand
+import scripts.pipeline as pipeline
+from scripts.misc import group_df_by_multiple_column_levels
+from conftest import weather
+
+
+def test_finishing_with_energy_of_all_years(parameters):
+
+    # Years processed separately with the energy of all years are scaled as in a run over all years
+    temperature, wind, mapped_population = weather(days=2 * 365)
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    hourly_space, _ = pipeline.hourly(reference_temperature, wind, parameters)
+    building_database = parameters['building_database']['space']
+
+    full = demand.finishing(hourly_space, mapped_population, building_database)
+    energy = pd.concat([demand.yearly_energy(hourly_space.loc[year], mapped_population) for year in ['2010', '2011']])
+
+    # The values of other countries at the turn of the year in UTC are missing in the separate years
+    for year in ['2010', '2011']:
+        part = demand.finishing(hourly_space.loc[year], mapped_population, building_database, energy)
+        pd.testing.assert_frame_equal(part, full.loc[part.index].where(part.notna()))
+
+
+def test_combine_complete_steps(parameters):
+
+    # Daily steps in UTC are the averages of the hourly values, where the first day, which only the first hour in
+    # local time of the countries east of UTC falls into, is dropped
+    temperature, wind, mapped_population = weather(days=14)
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    spatial_space, spatial_water, spatial_cop = pipeline.spatial(temperature, reference_temperature, wind,
+                                                                 mapped_population, parameters, 'D')
+    final_heat, final_cop = pipeline.national(spatial_space, spatial_water, spatial_cop, 'D')
+
+    days = pd.date_range('2010-01-01', '2010-01-14', freq='D', tz='utc')
+    assert final_heat.index.equals(days)
+    assert final_cop.index.equals(days)
+    assert not final_heat.isna().any().any()
+
+    hourly = demand.combine(spatial_space, spatial_water, rounded=False)
+    pd.testing.assert_frame_equal(final_heat.iloc[1:-1], hourly.resample('D').mean().round().loc[days[1:-1]],
+                                  check_freq=False)
+
+
+def reference_combine(space, water):
+
+    # Hourly combine before the aggregation into preallocated arrays
+    space = group_df_by_multiple_column_levels(space, ['country', 'unit', 'building_type'])
+    water = group_df_by_multiple_column_levels(water, ['country', 'unit', 'building_type'])
+    df = pd.concat([space, water], axis=1, keys=['space', 'water'],
+                   names=['attribute', 'country', 'unit', 'building_type'])
+
+    dfx = df.loc[:, df.columns.get_level_values('unit') == 'MW']
+    dfx = dfx.groupby(dfx.columns.droplevel('building_type'), axis=1).sum()
+    dfx.columns = pd.MultiIndex.from_tuples(dfx.columns)
+    dfx = pd.concat([dfx['space'], dfx['water'], dfx['space'] + dfx['water']], axis=1,
+                    keys=['space', 'water', 'total'], names=['attribute', 'country', 'unit'])
+
+    df.columns = pd.MultiIndex.from_tuples(
+        [('_'.join([level for level in [col_name[0], col_name[3]]]), col_name[1], col_name[2])
+         for col_name in df.columns.values]
+    )
+
+    df = pd.concat([dfx, df], axis=1).round()
+    df.replace(0, float('nan'), inplace=True)
+
+    df_short = df.loc[:, df.columns.get_level_values('unit') == 'MW'].copy().dropna(how='all')
+    df = df.fillna(method='bfill').fillna(method='ffill')
+    df[df_short.columns] = df_short.fillna(method='bfill').fillna(method='ffill')
+
+    df = pd.concat([
+        df.loc[:, df.columns.get_level_values('unit') == 'MW'],
+        df.loc[:, df.columns.get_level_values('unit') == 'MW/TWh']
+    ], axis=1, keys=['heat_demand', 'heat_profile'])
+    df = df.swaplevel(i=0, j=2, axis=1)
+    df = df.swaplevel(i=1, j=2, axis=1)
+    df = df.sort_index(level=0, axis=1)
+    df.columns.names = ['country', 'variable', 'attribute', 'unit']
+
+    return df
+
+
+def test_combine_filling(parameters):
+
+    # Values missing at the beginning and the end of the dataset arising from the local times of the countries
+    temperature, wind, mapped_population = weather(days=14)
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    spatial_space, spatial_water, _ = pipeline.spatial(temperature, reference_temperature, wind, mapped_population,
+                                                       parameters)
+    assert spatial_space.isna().any().any()
+
+    # Space heating of DE rounds to zero on the second day, e.g., in summer, and is zero at the end of the dataset
+    spatial_space.loc['2010-01-02':'2010-01-02T23:00', 'DE'] = 1e-3
+    spatial_space.loc['2010-01-14T12:00':, 'DE'] = spatial_space.loc['2010-01-14T12:00':, 'DE'] * 0
+
+    # The values missing at the edges are filled as in the original combine, which also filled rounded zeros with the
+    # next non-zero value (or the last one at the end), while they are kept now
+    combined = demand.combine(spatial_space, spatial_water)
+    expected = reference_combine(spatial_space, spatial_water)
+    assert combined.columns.equals(expected.columns)
+
+    zeros = (combined == 0).to_numpy()
+    space = combined.columns.get_level_values('attribute').str.startswith('space')
+    total = combined.columns.get_level_values('attribute') == 'total'
+    assert (zeros.any(axis=0) == ((combined.columns.get_level_values('country') == 'DE') & space)).all()
+    assert zeros[combined.index.get_indexer(pd.date_range('2010-01-02', '2010-01-02T23:00', freq='60min', tz='utc')),
+                 np.flatnonzero(space)[0]].all()
+    assert not zeros[:, total].any()
+    pd.testing.assert_frame_equal(combined.where(~zeros), expected.where(~zeros), check_dtype=False, check_freq=False)
@@ -0,0 +1,34 @@
+import sys
+import subprocess
+
+from conftest import root_path
+
+
+def test_import_time():
+
+    # Importing the modules of the processing must not pull in the geodata, netCDF, YAML or download packages, which
+    # are only needed for reading the raw data, for the metadata and for downloading
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import sys, scripts.demand, scripts.cop; print(*sys.modules)'],
+        cwd=root_path, capture_output=True, text=True, check=True
+    )
+
+    modules = set(result.stdout.split())
+    assert {'scripts.demand', 'scripts.cop'} <= modules
+    for module in ['geopandas', 'netCDF4', 'yaml', 'cdsapi']:
+        assert module not in modules
+
+    # The lines of -X importtime list the children of a module before the module itself, so that in reverse order
+    # each module is followed by the modules it imports
+    lines = [line[len('import time:'):].split('|') for line in result.stderr.splitlines()
+             if line.startswith('import time:') and 'self [us]' not in line]
+    parents = []
+    own_time = 0
+    for self_time, _, name in reversed(lines):
+        depth = (len(name) - len(name.lstrip())) // 2
+        parents = parents[:depth] + [name.strip().split('.')[0]]
+        if not {'pandas', 'numpy'} & set(parents):
+            own_time += int(self_time)
+
+    # Without pandas and NumPy, the imports take a few milliseconds, geopandas alone takes several hundred
+    assert own_time < 200000, 'Imports besides pandas and NumPy take {:.0f} ms'.format(own_time / 1000)
@@ -0,0 +1,68 @@
+import pytest
+import numpy as np
+import pandas as pd
+
+import scripts.interim as interim
+import scripts.demand as demand
+from conftest import weather
+
+
+def round_trip(data, path, **kwargs):
+
+    interim.save(data, path)
+    return interim.load(path, **kwargs)
+
+
+def test_round_trip(tmp_path, parameters):
+
+    # Frame with UTC index of hourly frequency and columns of four levels, and Series with a daily naive index
+    temperature, _, _ = weather()
+    temperature.index = temperature.index.tz_localize('utc')
+    assert temperature.index.freq is not None
+    reference_temperature = demand.reference_temperature(temperature['air'].tz_localize(None))['DE', 50., 10.]
+
+    for data in [temperature, temperature.tz_convert('Europe/Berlin'), reference_temperature]:
+        for mmap in [True, 'copy', False]:
+            loaded = round_trip(data, str(tmp_path / 'data'), mmap=mmap)
+            assert loaded.index.freq == data.index.freq
+            assert str(loaded.index.tz) == str(data.index.tz)
+            if isinstance(data, pd.Series):
+                pd.testing.assert_series_equal(loaded, data, check_exact=True)
+            else:
+                pd.testing.assert_frame_equal(loaded, data, check_exact=True)
+
+    # Population of the single grid cell of LU with a float and an integer coordinate
+    population = pd.Series([1000.], index=pd.MultiIndex.from_tuples([(49.5, 6)], names=['latitude', 'longitude']),
+                           name='population')
+    loaded = round_trip(population, str(tmp_path / 'population_LU'))
+    pd.testing.assert_series_equal(loaded, population, check_exact=True)
+    assert loaded.index.levels[1].dtype == population.index.levels[1].dtype
+
+    # Subsets of columns are selected by the values of one or several levels
+    path = str(tmp_path / 'temperature')
+    interim.save(temperature, path)
+    columns = temperature.columns
+    for selection in [{'country': 'GB'}, {'parameter': 'soil', 'country': ['DE', 'GB'], 'latitude': 50.25}]:
+        mask = np.ones(len(columns), dtype=bool)
+        for level, values in selection.items():
+            mask &= columns.get_level_values(level).isin(np.atleast_1d(values))
+        pd.testing.assert_frame_equal(interim.load(path, **selection), temperature.loc[:, mask], check_exact=True)
+
+
+def test_writable(tmp_path, parameters):
+
+    path = str(tmp_path / 'reference_temperature')
+    temperature, _, _ = weather()
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    interim.save(reference_temperature, path)
+    expected = demand.adjust_temperature(reference_temperature, parameters['heating_thresholds'])
+
+    # Memory-mapped values are read-only, while values mapped copy-on-write or read into memory can be changed in
+    # place without changing the file
+    with pytest.raises(ValueError, match='read-only'):
+        demand.adjust_temperature(interim.load(path), parameters['heating_thresholds'], inplace=True)
+    for mmap in ['copy', False]:
+        adjusted = demand.adjust_temperature(interim.load(path, mmap=mmap), parameters['heating_thresholds'],
+                                             inplace=True)
+        pd.testing.assert_frame_equal(adjusted, expected)
+    pd.testing.assert_frame_equal(interim.load(path), reference_temperature, check_exact=True)
@@ -0,0 +1,73 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import scripts.kernels as kernels
+import scripts.demand as demand
+import scripts.cop as cop
+from conftest import weather
+
+
+@pytest.fixture(params=['numpy', 'numba'])
+def backend(request):
+
+    # Without Numba, kernels.use falls back to the NumPy backend, which is already checked
+    if request.param == 'numba':
+        pytest.importorskip('numba')
+
+    yield request.param
+    kernels.use('pandas')
+
+
+def temperature_with_gaps():
+
+    # Missing values in single hours, in a whole day and in the last day of the air temperature of one location each
+    temperature, wind, _ = weather(days=7)
+    temperature.iloc[5, 0] = np.nan
+    temperature.iloc[30, 5] = np.nan
+    temperature.iloc[48:72, 1] = np.nan
+    temperature.iloc[-24:, 2] = np.nan
+
+    return temperature, wind
+
+
+def results(parameters):
+
+    temperature, wind = temperature_with_gaps()
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    adjusted_temperature = demand.adjust_temperature(reference_temperature, parameters['heating_thresholds'])
+
+    return {
+        'reference': reference_temperature,
+        'heat': demand.daily_heat(adjusted_temperature, wind, parameters['daily_parameters']),
+        'water': demand.daily_water(adjusted_temperature, wind, parameters['daily_parameters']),
+        'classes': demand.heat_classes(adjusted_temperature),
+        'cop': cop.spatial_cop(cop.source_temperature(temperature), cop.sink_temperature(temperature),
+                               parameters['cop_parameters'])
+    }
+
+
+def test_backends(backend, parameters):
+
+    # The kernels of each backend give the results of the DataFrame operations, including where values are missing
+    kernels.use('pandas')
+    expected = results(parameters)
+    kernels.use(backend)
+    actual = results(parameters)
+
+    # The COP is rounded to four decimals, where the last decimal may differ as the backends compute in other precisions
+    for name, df in expected.items():
+        assert df.isna().values.any(), name
+        pd.testing.assert_frame_equal(actual[name], df, check_dtype=False, rtol=1e-5, atol=2e-4, obj=name)
+
+
+def test_missing_values(backend):
+
+    # NaN propagates from either argument of the maximum and minimum in the kernels as with NumPy
+    kernels.use(backend)
+    t = np.array([[np.nan, 300.], [250., np.nan]])
+
+    assert np.array_equal(np.isnan(kernels.water(t, {'m_w': 1., 'b_w': 2., 'D': 3.})), np.isnan(t))
+    assert np.array_equal(np.isnan(kernels.classes(t)), np.isnan(t))
+    assert np.array_equal(np.isnan(kernels.cop(t, t[::-1], [6., -.1, .001])), np.isnan(t) | np.isnan(t[::-1]))
+    assert np.array_equal(np.isnan(kernels.cop(np.full((2, 2), 10.), t, [6., -.1, .001])), np.isnan(t))
@@ -0,0 +1,24 @@
+import numpy as np
+import pandas as pd
+
+import scripts.misc as misc
+
+
+def test_localize():
+
+    # The hour of the change to summer time is dropped and the hour of the change back is duplicated
+    index = pd.date_range('2015-01-01', '2016-01-01', freq='60min', closed='left')
+    df = pd.DataFrame({'value': np.arange(len(index))}, index=index)
+    localized = misc.localize(df.copy(), 'DE')
+
+    assert len(localized) == len(index)
+    assert localized.index.is_unique and localized.index.is_monotonic_increasing
+    assert (localized['value'] == index.get_loc('2015-03-29 02:00')).sum() == 0
+    assert (localized['value'] == index.get_loc('2015-10-25 02:00')).sum() == 2
+    assert (localized.index.tz_convert('utc').to_series().diff().dropna() == pd.Timedelta('60min')).all()
+    assert (localized.index.tz_localize(None) == index[localized['value']]).all()
+
+    # The localization of the index is reused for other frames on the same index, but not for other indices
+    pd.testing.assert_frame_equal(misc.localize(df * 2, 'DE'), localized * 2)
+    shifted = misc.localize(df.set_axis(index + pd.Timedelta('60min')), 'DE')
+    assert (shifted.index.tz_localize(None) == (index + pd.Timedelta('60min'))[shifted['value']]).all()
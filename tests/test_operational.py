@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import pandas as pd
+import pytest
+
+import scripts.demand as demand
+import scripts.pipeline as pipeline
+import scripts.operational as operational
+import scripts.write as write
+from conftest import weather
+
+
+def test_hourly_single_day(parameters):
+
+    # A single day is upsampled like the last day of a longer period
+    temperature, wind, _ = weather(days=7)
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    adjusted_temperature = demand.adjust_temperature(reference_temperature, parameters['heating_thresholds'])
+    daily_heat = demand.daily_heat(adjusted_temperature, wind, parameters['daily_parameters'])
+
+    all_days = demand.hourly_heat(daily_heat, reference_temperature, parameters['hourly_parameters'])
+    last_day = demand.hourly_heat(daily_heat.iloc[-1:], reference_temperature.iloc[-1:],
+                                  parameters['hourly_parameters'])
+
+    assert len(last_day) == 24
+    pd.testing.assert_frame_equal(last_day, all_days.iloc[-24:])
+
+
+def build(path, parameters):
+
+    # Full run written to the SQLite output and its state for operational.append
+    output_path = os.path.join(path, 'output')
+    interim_path = os.path.join(path, 'interim')
+    os.makedirs(output_path)
+    os.makedirs(interim_path)
+
+    temperature, wind, mapped_population = weather(days=14)
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    final_heat, final_cop = pipeline.national(*pipeline.spatial(temperature, reference_temperature, wind,
+                                                                mapped_population, parameters))
+    write.to_sql(write.shaping(final_heat, final_cop), output_path, os.getcwd())
+
+    hourly_space, hourly_water = pipeline.hourly(reference_temperature, wind, parameters)
+    operational.initialize(parameters, interim_path, temperature, hourly_space, hourly_water, mapped_population,
+                           wind)
+
+    return output_path, interim_path
+
+
+def read_output(output_path):
+
+    with sqlite3.connect(os.path.join(output_path, 'when2heat.sqlite')) as connection:
+        return pd.read_sql('SELECT * FROM when2heat ORDER BY utc_timestamp', connection, index_col='utc_timestamp')
+
+
+def test_append_single_day(tmp_path, parameters):
+
+    output_path, interim_path = build(str(tmp_path), parameters)
+
+    # One new day
+    new_temperature, _, _ = weather(start='2010-01-15', days=1, seed=1)
+    shaped_dfs = operational.append(new_temperature, interim_path, output_path, os.getcwd())
+
+    assert not shaped_dfs['singleindex'].isna().any().any()
+    timestamps = pd.to_datetime(read_output(output_path).index)
+    assert timestamps.is_unique
+    assert timestamps[-1] == pd.Timestamp('2010-01-15 23:00', tz='utc')
+
+
+def test_append_overlapping_days(tmp_path, parameters):
+
+    # A day appended again with two further days (e.g., an updated forecast) gives the same output and state as if
+    # only the updated days had been appended
+    updated_temperature, _, _ = weather(start='2010-01-15', days=3, seed=2)
+    results = []
+    for path, first_temperature in [('overlap', weather(start='2010-01-15', days=1, seed=1)[0]), ('direct', None)]:
+        output_path, interim_path = build(str(tmp_path / path), parameters)
+        if first_temperature is not None:
+            operational.append(first_temperature, interim_path, output_path, os.getcwd())
+        operational.append(updated_temperature, interim_path, output_path, os.getcwd())
+        results.append((read_output(output_path), pd.read_pickle(os.path.join(interim_path, 'operational_state'))))
+
+    (overlap, overlap_state), (direct, direct_state) = results
+    assert overlap.index.is_unique
+    assert overlap.index[-1] == '2010-01-17T23:00:00Z'
+    pd.testing.assert_frame_equal(overlap, direct)
+    pd.testing.assert_frame_equal(overlap_state['daily_average'], direct_state['daily_average'])
+
+    # A gap after the last day is rejected
+    with pytest.raises(ValueError):
+        operational.append(weather(start='2010-01-19', days=1)[0], interim_path, output_path, os.getcwd())
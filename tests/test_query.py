@@ -0,0 +1,55 @@
+import os
+import numpy as np
+import pandas as pd
+
+import scripts.demand as demand
+import scripts.pipeline as pipeline
+import scripts.query as query
+import scripts.write as write
+from conftest import weather
+
+
+def test_build_and_select(tmp_path, parameters):
+
+    # Output of two weeks written as multiindex CSV
+    temperature, wind, mapped_population = weather()
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    final_heat, final_cop = pipeline.national(*pipeline.spatial(temperature, reference_temperature, wind,
+                                                                mapped_population, parameters))
+    write.to_csv({'multiindex': write.shaping(final_heat, final_cop)['multiindex']}, str(tmp_path))
+    expected = pd.read_csv(os.path.join(str(tmp_path), 'when2heat_multiindex.csv'), header=[0, 1, 2, 3],
+                           index_col=[0, 1])
+    expected.index = pd.DatetimeIndex(pd.to_datetime(expected.index.get_level_values(0), utc=True),
+                                      name='utc_timestamp')
+
+    # The store holds the values of the CSV
+    path = query.build(str(tmp_path))
+    df = query.select(path)
+    assert df.columns.equals(expected.columns)
+    pd.testing.assert_frame_equal(df, expected.astype('float64'), check_names=False)
+
+    # Columns are selected by their levels and rows from start (inclusive) to end (exclusive)
+    selected = query.select(path, countries=['GB'], variables=['COP', 'heat_demand'], start='2010-01-03',
+                            end='2010-01-05T06:00')
+    columns = expected.columns.get_level_values('country') == 'GB'
+    columns &= expected.columns.get_level_values('variable').isin(['COP', 'heat_demand'])
+    pd.testing.assert_frame_equal(
+        selected, expected.loc['2010-01-03':'2010-01-05T05:00', columns].astype('float64'), check_names=False
+    )
+
+    # For daily values, heat is averaged and the COP is the ratio of the heat to the power of each day, where the heat
+    # of each sink is the sum of its profiles, also if the profiles are not selected
+    daily = query.select(path, resolution='D')
+    for country, variable, attribute, unit in expected.columns:
+        values = expected[(country, variable, attribute, unit)]
+        if variable == 'COP':
+            sink = 'water' if attribute.endswith('water') else 'space'
+            profiles = expected[country]['heat_profile']
+            heat = profiles.loc[:, profiles.columns.get_level_values(0).str.startswith(sink + '_')].sum(axis=1)
+            aggregated = heat.resample('D').sum() / (heat / values).resample('D').sum()
+        else:
+            aggregated = values.resample('D').mean()
+        assert np.allclose(daily[(country, variable, attribute, unit)], aggregated, rtol=1e-12)
+
+    pd.testing.assert_frame_equal(query.select(path, countries='DE', variables='COP', resolution='D'),
+                                  daily.loc[:, [column for column in daily.columns if column[0:2] == ('DE', 'COP')]])
@@ -0,0 +1,46 @@
+import os
+import numpy as np
+import pandas as pd
+
+import scripts.demand as demand
+import scripts.pipeline as pipeline
+import scripts.scenarios as scenarios
+import scripts.write as write
+from conftest import weather
+
+
+def test_sweep(tmp_path, parameters):
+
+    temperature, wind, mapped_population = weather()
+    reference_temperature = demand.reference_temperature(temperature['air'])
+
+    # Scenarios deviating in the heating threshold of GB (relative to that of DE), in the daily parameters, in the
+    # hourly parameters, where the factors of single-family houses are shifted by one hour, and in the COP parameters
+    hourly_parameters = dict(parameters['hourly_parameters'])
+    hourly_parameters['SFH'] = hourly_parameters['SFH'].set_axis(np.roll(hourly_parameters['SFH'].index, 1))
+    scenario_list = {
+        'base': {},
+        'thresholds': {'heating_thresholds': parameters['heating_thresholds'].add(pd.Series({'GB': 2}), fill_value=0)},
+        'daily': {'daily_parameters': parameters['daily_parameters'] * 1.1},
+        'hourly': {'hourly_parameters': hourly_parameters},
+        'cop': {'cop_parameters': parameters['cop_parameters'] * 1.1},
+    }
+    scenarios.sweep(scenario_list, temperature, reference_temperature, wind, mapped_population, parameters,
+                    str(tmp_path))
+
+    # Each scenario is written as by a run of the pipeline with its parameters
+    contents = {}
+    for name, deviations in scenario_list.items():
+        final_heat, final_cop = pipeline.national(*pipeline.spatial(
+            temperature, reference_temperature, wind, mapped_population, dict(parameters, **deviations)
+        ))
+        expected_path = tmp_path / 'expected' / name
+        os.makedirs(expected_path)
+        write.to_csv({'multiindex': write.shaping(final_heat, final_cop)['multiindex']}, str(expected_path))
+
+        with open(tmp_path / 'scenarios' / name / 'when2heat_multiindex.csv', 'rb') as f:
+            contents[name] = f.read()
+        with open(expected_path / 'when2heat_multiindex.csv', 'rb') as f:
+            assert contents[name] == f.read(), name
+
+    assert len(set(contents.values())) == len(scenario_list)
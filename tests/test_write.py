@@ -0,0 +1,84 @@
+import os
+import gzip
+import hashlib
+import pytest
+import numpy as np
+import pandas as pd
+
+import scripts.demand as demand
+import scripts.pipeline as pipeline
+import scripts.write as write
+from conftest import weather
+
+
+def test_timestamps():
+
+    # Hourly timestamps of a year and timestamps of irregular seconds around both changes of the daylight saving time
+    indices = [
+        pd.date_range('2015-01-01', '2016-01-01', freq='60min', closed='left', tz='utc'),
+        pd.date_range('2015-03-29T00:30', '2015-03-29T01:30', freq='37s', tz='utc'),
+        pd.date_range('2015-10-25T00:30', '2015-10-25T01:30', freq='37s', tz='utc')
+    ]
+
+    for index in indices:
+        local = index.tz_convert('Europe/Brussels')
+        formatted = write.timestamps(index)
+        assert (formatted['utc'] == index.strftime('%Y-%m-%dT%H:%M:%SZ')).all()
+        assert (formatted['cet_cest'] == local.strftime('%Y-%m-%dT%H:%M:%S%z')).all()
+        assert (formatted['cet_cest_naive'] == local.strftime('%Y-%m-%dT%H:%M:%S')).all()
+
+    # Empty indices give empty arrays
+    for strings in write.timestamps(pd.DatetimeIndex([], tz='utc')).values():
+        assert isinstance(strings, np.ndarray) and len(strings) == 0
+
+
+def shaped_output(parameters):
+
+    temperature, wind, mapped_population = weather()
+    reference_temperature = demand.reference_temperature(temperature['air'])
+    final_heat, final_cop = pipeline.national(*pipeline.spatial(temperature, reference_temperature, wind,
+                                                                mapped_population, parameters))
+    shaped_dfs = write.shaping(final_heat, final_cop)
+
+    return {shape: shaped_dfs[shape] for shape in ['multiindex', 'singleindex']}
+
+
+def expected_bytes(shape, df):
+
+    # Files as written by pandas at once
+    options = {'sep': ';', 'decimal': ','} if shape == 'singleindex' else {}
+    return df.to_csv(float_format='%g', **options).encode()
+
+
+def read(file):
+
+    with open(file, 'rb') as f:
+        return f.read()
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+@pytest.mark.parametrize('compression', [None, 'gzip'])
+def test_to_csv(tmp_path, parameters, compression, processes):
+
+    shaped_dfs = shaped_output(parameters)
+    decompress = gzip.decompress if compression == 'gzip' else (lambda data: data)
+
+    # Files written at once and in two parts, the second one appended, where the checksum of the first part is
+    # continued and, after the checksums are discarded (e.g., in a new process), computed from the file
+    for name, parts in [('full', [('w', slice(None))]),
+                        ('continued', [('w', slice(None, 100)), ('a', slice(100, None))]),
+                        ('read', [('w', slice(None, 100)), ('a', slice(100, None))])]:
+        path = tmp_path / name
+        os.makedirs(path)
+        for mode, rows in parts:
+            if name == 'read':
+                write._digests.clear()
+            results = write.to_csv({shape: df.iloc[rows] for shape, df in shaped_dfs.items()}, str(path), mode=mode,
+                                   compression=compression, processes=processes, block_size=48)
+
+        for shape, df in shaped_dfs.items():
+            file_name = ('when2heat.csv' if shape == 'singleindex' else 'when2heat_multiindex.csv') + \
+                        ('.gz' if compression == 'gzip' else '')
+            data = read(path / file_name)
+            assert decompress(data) == expected_bytes(shape, df), (name, shape)
+            assert results[file_name] == {'bytes': len(data), 'hash': hashlib.md5(data).hexdigest()}, (name, shape)